@@ -3,6 +3,9 @@ from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
 import numpy as np
 import collections
 import itertools 
+import os
+import uuid
+from modeling import Binning
 from utils.numba_functions import nb_log, nb_sum, nb_where, nb_random_poisson
 
 __all__ = ["DataSet"]
@@ -11,17 +14,27 @@ DATATYPES = ["unblinding", "simulation", "scrambling"]
 
 class DataSet():
     
-    def __init__(self, values = None, errors2 = None, data_type = "simulation",  **kwargs):
+    #Datasets pickled before binnings and regions of interest existed do not have the attributes
+    _binning = None
+    _events = None
+    
+    def __init__(self, values = None, errors2 = None, data_type = "simulation", binning = None, **kwargs):
         
         self.ntotal = 0
+        self._binning = binning
+        self._rois = {}
+        self._events = None
         
         if values is not None:
             values = np.asarray(values)
-            self.values = values
+            #N-D histograms are kept flattened, the binning keeps the shape
+            if self._binning is None:
+                self._binning = Binning.from_shape(values.shape)
+            self.values = np.ravel(values)
            
         if errors2 is not None:
             errors2 = np.asarray(errors2)
-            self.errors2 = errors2
+            self.errors2 = np.ravel(errors2)
         
         self.data_type = data_type
         
@@ -57,6 +70,160 @@ class DataSet():
         
         self._errors2 = np.asarray(errors2)
    
+    @property
+    def binning(self) -> Optional[Binning]:
+        return self._binning
+    
+    @binning.setter
+    def binning(self, value: Binning):
+        self._binning = value
+        
+    def _require_binning(self) -> Binning:
+        if self._binning is None:
+            raise AttributeError("DataSet has no binning, it has no N-D shape")
+        return self._binning
+    
+    @property
+    def shape(self) -> tuple:
+        return self._require_binning().shape
+    
+    @property
+    def edges(self) -> list:
+        return self._require_binning().edges
+    
+    def reshape(self, values = None) -> np.ndarray:
+        """Values (or any per-bin array, e.g. residuals) in the N-D shape of the histogram"""
+        if values is None:
+            values = self.values
+        return self._require_binning().reshape(values)
+    
+    @property
+    def rois(self) -> dict:
+        """Named regions of interest, name -> flat index of the selected bins"""
+        if "_rois" not in self.__dict__:
+            self._rois = {}
+        return self._rois
+    
+    def add_roi(self, name, cuts = None, **kwargs):
+        """ Defines a named region of interest from cuts on the bin centers, e.g.
+        ds.add_roi("psi<0.5", psi_reco=(None, 0.5), E_reco=(100, 1e4))
+        The selection is stored as a precomputed index of bins."""
+        self.rois[str(name)] = self._require_binning().index(cuts, **kwargs)
+        return self.rois[str(name)]
+        
+    @classmethod
+    def from_events(cls, events, binning, chunksize = 2**20, cache_dir = None, data_type = "simulation", **kwargs):
+        """ DataSet of individual events for unbinned likelihoods, see set_events """
+        ds = cls(data_type=data_type, binning=binning, **kwargs)
+        ds.set_events(events, chunksize=chunksize, cache_dir=cache_dir)
+        return ds
+
+    @classmethod
+    def load_events(cls, path, binning, mmap = True, **kwargs):
+        """ Events from a .npy file (nevents, ndim), memory-mapped read-only by default so
+        samples larger than memory are only paged in chunk by chunk """
+        return cls.from_events(np.load(path, mmap_mode="r" if mmap else None), binning, **kwargs)
+
+    def set_events(self, events, binning = None, chunksize = 2**20, cache_dir = None):
+        """ Sets the events of the dataset: an array (nevents, ndim) with the coordinates of each
+        event along the axes of the binning, or a mapping axis name -> array (nevents,).
+        Arrays can be memory-mapped, they are only read in chunks of chunksize events.
+
+        The bin of each event is looked up once (searchsorted on the edges) and cached,
+        in memory or as .npy files in cache_dir for samples that do not fit in memory.
+        Cache files are named events_<id>_*.npy with an id unique to each call, so several
+        datasets can share a cache_dir.
+        Values are filled with the histogram of the events, so binned likelihoods can be
+        used on the same dataset. Events outside of the binning are dropped.
+        """
+        if binning is not None:
+            self._binning = binning
+        if self._binning is None or not isinstance(self._binning, Binning):
+            raise AttributeError("DataSet needs a binning with edges to hold events")
+        if isinstance(events, Mapping):
+            nevents = len(events[self._binning.names[0]])
+        else:
+            if np.ndim(events) == 1 and self._binning.ndim == 1:
+                events = np.reshape(events, (-1, 1))
+            if np.ndim(events) != 2 or np.shape(events)[1] != self._binning.ndim:
+                raise ValueError("Events need a shape (nevents, {})".format(self._binning.ndim))
+            nevents = len(events)
+
+        self._events = events
+        self._nevents = nevents
+        self._chunksize = int(chunksize)
+        self._cache_dir = cache_dir
+        self._cache_id = uuid.uuid4().hex[:12]
+        self._interpolation = None
+
+        dtype = np.int32 if self._binning.nbins < 2**31 else np.int64
+        self._event_bins = self._allocate("bins", (nevents,), dtype)
+        counts = np.zeros(self._binning.nbins)
+        for chunk in self.event_chunks():
+            bins = self._binning.lookup(self._event_chunk(chunk))
+            self._event_bins[chunk] = bins
+            counts += np.bincount(bins[bins >= 0], minlength=self._binning.nbins)
+        self.values = counts
+
+    def _allocate(self, name, shape, dtype):
+        #Event caches in memory, or memory-mapped in the cache directory
+        if self._cache_dir is None:
+            return np.empty(shape, dtype=dtype)
+        path = os.path.join(self._cache_dir, "events_{}_{}.npy".format(self._cache_id, name))
+        return np.lib.format.open_memmap(path, mode="w+", shape=shape, dtype=dtype)
+
+    def _event_chunk(self, chunk) -> np.ndarray:
+        #Coordinates (n, ndim) of a chunk of events, read from the (possibly memory-mapped) arrays
+        if isinstance(self._events, Mapping):
+            return np.column_stack([np.asarray(self._events[name][chunk], dtype=float) for name in self._binning.names])
+        return np.asarray(self._events[chunk], dtype=float)
+
+    @property
+    def events(self):
+        return self._events
+
+    @property
+    def chunksize(self) -> int:
+        """Number of events read at once by the unbinned likelihood"""
+        return self._chunksize
+
+    @property
+    def nevents(self) -> int:
+        """Number of events, including the ones outside of the binning"""
+        return self._nevents if self._events is not None else 0
+
+    def event_chunks(self, chunksize = None):
+        """Slices of chunksize events (default: the chunksize of set_events)"""
+        chunksize = chunksize or self._chunksize
+        for start in range(0, self.nevents, chunksize):
+            yield slice(start, min(start + chunksize, self.nevents))
+
+    @property
+    def event_bins(self) -> np.ndarray:
+        """Cached flat bin index of each event, -1 outside of the binning"""
+        if self._events is None:
+            raise AttributeError("Events not set yet!")
+        return self._event_bins
+
+    @property
+    def event_interpolation(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Cached Binning.interpolation_lookup of the events inside the binning, computed on
+        first use: index (int32) and fraction (float32) arrays of shape (n_inside, ndim) """
+        if self._events is None:
+            raise AttributeError("Events not set yet!")
+        if self._interpolation is None:
+            ninside = int(self.ntotal)
+            shape = (ninside, self._binning.ndim)
+            index = self._allocate("index", shape, np.int32)
+            fraction = self._allocate("fraction", shape, np.float32)
+            start = 0
+            for chunk in self.event_chunks():
+                x = self._event_chunk(chunk)[self._event_bins[chunk] >= 0]
+                index[start:start + len(x)], fraction[start:start + len(x)] = self._binning.interpolation_lookup(x)
+                start += len(x)
+            self._interpolation = (index, fraction)
+        return self._interpolation
+
     def fill_errors2(self):
         """ Fill errors as sqrt(n) """
         self._errors2 = self._values
@@ -81,14 +248,25 @@ class DataSet():
         "Makes a pseudo sample"
        
         self.values = list(map(nb_random_poisson, ntotal * np.asarray(model)))
+        self._events = None
+        self._inherit_binning(model)
 
     def asimov(self, ntotal, model):
         "Makes a Asimov sample"
        
         self.values = list(ntotal * np.asarray(model))
+        self._events = None
+        self._inherit_binning(model)
+        
+    def _inherit_binning(self, model):
+        #Pseudo samples take the binning of the model if the dataset has none
+        if self._binning is None and hasattr(model, "binning"):
+            self._binning = model.binning
 
     def __str__(self):
         lines = []
         lines.append("DataSet type {}".format(self._data_type))
         lines.append("Total number of events: {}".format(self.ntotal))
+        if self._events is not None:
+            lines.append("Unbinned: {} events, {} inside the binning".format(self.nevents, int(self.ntotal)))
         return "\n".join(lines)
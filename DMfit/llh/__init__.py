@@ -1,2 +1,6 @@
-
-from .likelihoods import LikelihoodRatioTest
\ No newline at end of file
+from .likelihoods import LikelihoodRatioTest
+from .belt import ConfidenceBelt
+from .tsdist import TSDistribution
+from .sampler import EnsembleSampler
+from .minimizers import MinimizerBackend, MinuitBackend, ScipyBackend
+from .spec import ModelSpec, LikelihoodSpec
\ No newline at end of file
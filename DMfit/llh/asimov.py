@@ -0,0 +1,48 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import collections
+from data import DataSet
+
+from .trials import _fresh
+
+__all__ = ["asimov_sensitivity", "merging_loss"]
+
+
+def asimov_sensitivity(lr, parname, value, ntotal) -> dict:
+    """ Median sensitivity to a signal parameter from the Asimov dataset of H1 with parname = value
+    (other parameters at their current values in H1):
+
+    - ts: TS of the Asimov dataset, the median TS of the signal (sqrt(ts) is the median significance)
+    - error: expected error of parname from the expected Fisher information at the truth
+
+    The parameters of lr are not modified.
+    """
+    test = _fresh(lr)
+    test.models["H1"].parameters[parname].value = value
+    ds = DataSet(binning=test.models["H1"].binning)
+    ds.asimov(ntotal, test.models["H1"][:])
+    test.data = ds
+    error = test.errors("H1", "expected")[parname] if test.has_gradient else np.nan
+    test.fit("H0")
+    test.fit("H1")
+    return {"ts" : max(test.TS, 0.), "error" : error, "nbins" : len(test.models["H1"])}
+
+
+def merging_loss(lr, merging, parname, value, ntotal, verbose = True) -> dict:
+    """ Sensitivity lost by merging bins (BinMerging): Asimov sensitivity (see asimov_sensitivity)
+    on the original and on the merged bins.
+
+    Returns a dictionary with both sensitivities, the relative loss of TS (1 - ts_merged / ts) and
+    the relative increase of the expected error on parname.
+    """
+    original = asimov_sensitivity(lr, parname, value, ntotal)
+    merged = asimov_sensitivity(lr.merge(merging), parname, value, ntotal)
+    report = {"original" : original,
+              "merged" : merged,
+              "ts_loss" : 1. - merged["ts"] / original["ts"] if original["ts"] > 0 else np.nan,
+              "error_increase" : merged["error"] / original["error"] - 1.}
+    if verbose:
+        print("Bins: {} -> {}".format(original["nbins"], merged["nbins"]))
+        print("Asimov TS: {:.4g} -> {:.4g} ({:.2%} lost)".format(original["ts"], merged["ts"], report["ts_loss"]))
+        print("Expected error of {}: {:.4g} -> {:.4g} ({:+.2%})".format(parname, original["error"], merged["error"], report["error_increase"]))
+    return report
@@ -0,0 +1,300 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import collections
+import os
+import hashlib
+import json
+from data import DataSet
+
+from .likelihoods import LikelihoodRatioTest
+from .spec import ModelSpec
+from utils.arraystore import ArrayStore
+from utils.numba_functions import nb_seed, process_pool
+
+__all__ = ["ConfidenceBelt"]
+
+ORDERINGS = ["feldman-cousins", "neyman-upper"]
+
+#Default number of trials per task. The seeds of the tasks depend on the chunking, so it does
+#not depend on the number of processes: the same seed gives the same belt on any machine
+CHUNKSIZE = 25
+
+
+def _run_belt_trials(args):
+    """ Pseudo-experiments at a single true value of the parameter, runs in a worker process.
+
+    Both hypotheses are built from the same model: H0 has the parameter fixed at the
+    true value (conditional fit), H1 leaves it free. The models keep the best fit of
+    the previous trial, so every fit is warm started from the last one.
+    """
+    model, parname, true_value, ntotal, ntrials, seed, roi, settings = args
+    if isinstance(model, ModelSpec):
+        model = model.build()
+
+    lr = LikelihoodRatioTest(model=model, null_model=model, roi=roi, **settings)
+    lr.models["H0"].parameters[parname].value = true_value
+    lr.models["H0"].parameters[parname].fixed = True
+    lr.models["H1"].parameters[parname].value = true_value
+    lr.models["H1"].parameters[parname].fixed = False
+
+    #Expectation is evaluated once, models are modified by the fits afterwards
+    expectation = lr.models["H1"][:]
+
+    nb_seed(seed)
+    ds = DataSet(binning=lr.models["H1"].binning)
+    lr.data = ds
+
+    ts = np.zeros(ntrials)
+    best = np.zeros(ntrials)
+    for i in range(ntrials):
+        ds.sample(ntotal, expectation)
+        lr.fit("H0")
+        lr.fit("H1")
+        #Physical boundary is enforced by the limits, TS can only be negative by numerical noise
+        ts[i] = max(lr.TS, 0.)
+        best[i] = lr.models["H1"].parameters[parname].value
+    return ts, best
+
+
+class ConfidenceBelt():
+    """ Neyman confidence belt for a single parameter of a model
+
+    The belt is built with pseudo-experiments on a grid of true values. For each
+    value the acceptance region is stored as the interval of best-fit values
+    [accept_low, accept_high] that are accepted, so the confidence interval for an
+    observed best fit is a lookup on the belt.
+
+    Orderings:
+    - "feldman-cousins": events are ranked by the likelihood ratio TS (unified approach)
+    - "neyman-upper": one sided, accepted best fits are above the (1 - C.L.) quantile
+    """
+
+    def __init__(self, parname, grid, critical, accept_low, accept_high, conf_level = 90, ordering = "feldman-cousins", ts = None, best = None, limits = None, **kwargs):
+        self.parname = parname
+        self.grid = np.asarray(grid, dtype=float)
+        self.critical = np.asarray(critical, dtype=float)
+        self.accept_low = np.asarray(accept_low, dtype=float)
+        self.accept_high = np.asarray(accept_high, dtype=float)
+        self.conf_level = conf_level
+        self.ordering = ordering
+        #Raw trials, shape (len(grid), ntrials)
+        self.ts = ts
+        self.best = best
+        #Physical limits of the parameter, by default the ends of the grid
+        self.limits = (float(self.grid[0]), float(self.grid[-1])) if limits is None else tuple(float(v) for v in limits)
+        self._meta_data = kwargs.copy()
+
+    @property
+    def meta_data(self) -> dict:
+        return self._meta_data
+
+    @property
+    def ordering(self) -> str:
+        return self._ordering
+
+    @ordering.setter
+    def ordering(self, value: str):
+        if value not in ORDERINGS:
+            raise ValueError("Ordering {} is not implemented, available orderings are {}".format(value, ORDERINGS))
+        self._ordering = value
+
+    @staticmethod
+    def cache_key(model, parname, grid, ntotal, ntrials, conf_level, ordering, seed, roi = None, likelihood = None, chunksize = CHUNKSIZE) -> str:
+        """ Key of a belt in the cache: model hash, template hash and a hash of the settings.
+        The values of the other parameters are the truth of the pseudo-experiments, so they are part of the settings.
+        likelihood are the settings of the LikelihoodRatioTest (LikelihoodRatioTest.settings), the likelihood
+        and the minimizer change the trials, the number of threads and the memory budget do not.
+        The chunksize sets the seeds of the trials, so it is part of the settings."""
+        truth = [(name, par.value) for name, par in model.parameters.items() if name != parname]
+        settings = repr((parname, np.asarray(grid, dtype=float).tolist(), truth, float(ntotal), ntrials, conf_level, ordering, seed, int(chunksize)))
+        if likelihood is not None:
+            minimizer = likelihood["minimizer"]
+            settings += repr((likelihood["llh_type"], likelihood["density"], type(minimizer).__name__, sorted(vars(minimizer).items())))
+        if roi is not None:
+            settings += hashlib.sha1(np.ascontiguousarray(roi).tobytes()).hexdigest()
+        return "{}_{}_{}".format(model.structure_hash()[:12], model.template_hash()[:12], hashlib.sha1(settings.encode()).hexdigest()[:12])
+
+    @classmethod
+    def build(cls, lr, parname, grid, ntotal, ntrials = 100, conf_level = 90, ordering = "feldman-cousins", nprocesses = None, chunksize = CHUNKSIZE, seed = None, cache_dir = None):
+        """ Build the belt from the H1 model of a LikelihoodRatioTest
+
+        Parameters:
+        - lr: LikelihoodRatioTest, only the H1 model, the roi and the settings of the likelihood
+              (type, minimizer, threads) are used. The current values of the other parameters
+              are used as truth for the pseudo-experiments
+        - parname: name of the parameter the belt is built for
+        - grid: true values of the parameter
+        - ntotal: number of events of the pseudo-experiments
+        - ntrials: pseudo-experiments per grid point
+        - nprocesses: size of the process pool, 1 runs everything in this process
+        - chunksize: trials per task (each task has its own seed)
+        - seed: seed of the pseudo-experiments, needed for the belt to be reproducible
+        - cache_dir: if given the belt is loaded from / saved to this directory
+
+        Note: as the grid x trials is split in tasks the result for a given seed depends on
+        the chunksize, but not on the number of processes.
+        """
+        if ordering not in ORDERINGS:
+            raise ValueError("Ordering {} is not implemented, available orderings are {}".format(ordering, ORDERINGS))
+
+        model = lr.models["H1"]
+        if parname not in model.parameters.keys():
+            raise ValueError("Parameter {} is not in the model".format(parname))
+        if lr.llh_type == "Unbinned" and lr.density == "linear":
+            raise ValueError("Pseudo-experiments have no event lists, a belt cannot use the linear density")
+        settings = lr.settings()
+
+        grid = np.sort(np.asarray(grid, dtype=float))
+
+        path = None
+        if cache_dir is not None:
+            key = cls.cache_key(model, parname, grid, ntotal, ntrials, conf_level, ordering, seed, lr.roi, settings, chunksize)
+            path = os.path.join(cache_dir, "belt_{}.npz".format(key))
+            if os.path.exists(path):
+                return cls.load(path)
+
+        if nprocesses is None:
+            nprocesses = os.cpu_count()
+        chunks = [min(chunksize, ntrials - start) for start in range(0, ntrials, chunksize)]
+
+        seeds = np.random.SeedSequence(seed).generate_state(len(grid) * len(chunks))
+        #Workers get a spec with the templates in shared memory instead of a pickled copy of the model
+        with ArrayStore() as store:
+            source = model if nprocesses == 1 else ModelSpec(model, store)
+            tasks = []
+            for i, true_value in enumerate(grid):
+                for j, n in enumerate(chunks):
+                    tasks.append((source, parname, true_value, ntotal, n, int(seeds[i * len(chunks) + j]), lr.roi, settings))
+
+            if nprocesses == 1:
+                results = list(map(_run_belt_trials, tasks))
+            else:
+                with process_pool(nprocesses) as pool:
+                    results = list(pool.map(_run_belt_trials, tasks))
+
+        ts = np.concatenate([r[0] for r in results]).reshape(len(grid), ntrials)
+        best = np.concatenate([r[1] for r in results]).reshape(len(grid), ntrials)
+
+        par = model.parameters[parname]
+        critical, accept_low, accept_high = cls._acceptance(ts, best, conf_level, ordering, par.upper_limit)
+
+        belt = cls(parname, grid, critical, accept_low, accept_high, conf_level=conf_level, ordering=ordering, ts=ts, best=best,
+                   limits=(par.lower_limit, par.upper_limit), ntotal=float(ntotal), ntrials=int(ntrials),
+                   seed=None if seed is None else int(seed), model=model.name, llh_type=lr.llh_type)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            belt.save(path)
+        return belt
+
+    @staticmethod
+    def _acceptance(ts, best, conf_level, ordering, upper_limit):
+        """ Acceptance regions in best-fit space for each row of trials """
+        alpha = conf_level / 100.
+        if ordering == "feldman-cousins":
+            critical = np.quantile(ts, alpha, axis=1, method="higher")
+            accepted = ts <= critical[:, None]
+            accept_low = np.where(accepted, best, np.inf).min(axis=1)
+            accept_high = np.where(accepted, best, -np.inf).max(axis=1)
+        else:
+            critical = np.quantile(best, 1. - alpha, axis=1, method="lower")
+            accept_low = critical
+            accept_high = np.full(len(critical), upper_limit)
+        return critical, accept_low, accept_high
+
+    def _tolerance(self) -> float:
+        """Best fits closer than this to a physical limit are on the limit, far below the resolution of the grid"""
+        steps = np.diff(self.grid)
+        return 1e-3 * np.min(steps[steps > 0]) if np.any(steps > 0) else 0.
+
+    def _bound(self, values) -> np.ndarray:
+        """ Acceptance bound forced to be monotonic in the true value (trial fluctuations can break it),
+        with best fits within a small tolerance of a physical limit (the minimizer stops close to,
+        not at, the limit) moved onto the limit """
+        lower_limit, upper_limit = self.limits
+        tol = self._tolerance()
+        values = np.clip(values, lower_limit, upper_limit)
+        values = np.where(values - lower_limit <= tol, lower_limit, values)
+        values = np.where(upper_limit - values <= tol, upper_limit, values)
+        return np.maximum.accumulate(values)
+
+    def interval(self, best_fit) -> Tuple[float, float]:
+        """ Confidence interval for an observed best-fit value of the parameter
+
+        The interval contains every true value whose acceptance region contains the observed
+        best fit: the upper end is the largest true value whose lower acceptance bound is below
+        the best fit, the lower end the smallest true value whose upper acceptance bound is above
+        it. Ends are interpolated between grid points, bounds are monotonic (see _bound) and can
+        have runs of equal values, e.g. at the physical limit, so the interpolation is only done
+        on the strictly increasing segment around the best fit. A best fit on the limit gives the
+        first true value above the run of true values accepting the limit (the first one that
+        rejects it), so a coarse grid gives a conservative limit. The interval is never empty.
+        """
+        grid = self.grid
+        best_fit = float(np.clip(best_fit, *self.limits))
+        on_limit = best_fit - self.limits[0] <= self._tolerance()
+        if on_limit:
+            best_fit = self.limits[0]
+        low = self._bound(self.accept_low)
+        high = self._bound(self.accept_high)
+
+        #Last true value with low <= best fit
+        k = np.searchsorted(low, best_fit, side="right") - 1
+        if k < 0:
+            upper = grid[0]
+        elif k == len(grid) - 1:
+            upper = grid[-1]
+        elif on_limit:
+            upper = grid[k + 1]
+        else:
+            upper = grid[k] + (best_fit - low[k]) / (low[k + 1] - low[k]) * (grid[k + 1] - grid[k])
+
+        #First true value with high >= best fit
+        k = np.searchsorted(high, best_fit, side="left")
+        if k == 0:
+            lower = grid[0]
+        elif k == len(grid):
+            lower = grid[-1]
+        else:
+            lower = grid[k - 1] + (best_fit - high[k - 1]) / (high[k] - high[k - 1]) * (grid[k] - grid[k - 1])
+        if upper <= lower:
+            #No true value accepts the best fit between grid points: the next grid point is the limit
+            upper = grid[min(np.searchsorted(grid, lower, side="right"), len(grid) - 1)]
+        return float(lower), float(upper)
+
+    def upperlimit(self, best_fit) -> float:
+        return self.interval(best_fit)[1]
+
+    def limit(self, lr) -> Tuple[float, float]:
+        """ Fits H1 of a LikelihoodRatioTest (with data loaded) and returns the confidence interval """
+        lr.fit("H1")
+        return self.interval(lr.models["H1"].parameters[self.parname].value)
+
+    def save(self, path):
+        arrays = {"grid" : self.grid,
+                  "critical" : self.critical,
+                  "accept_low" : self.accept_low,
+                  "accept_high" : self.accept_high}
+        if self.ts is not None:
+            arrays["ts"] = self.ts
+            arrays["best"] = self.best
+        np.savez(path, parname=self.parname, conf_level=self.conf_level, ordering=self.ordering, limits=np.asarray(self.limits),
+                 meta_data=json.dumps(self._meta_data), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            ts = f["ts"] if "ts" in f.files else None
+            best = f["best"] if "best" in f.files else None
+            limits = f["limits"] if "limits" in f.files else None
+            meta_data = json.loads(str(f["meta_data"])) if "meta_data" in f.files else {}
+            return cls(str(f["parname"]), f["grid"], f["critical"], f["accept_low"], f["accept_high"],
+                       conf_level=float(f["conf_level"]), ordering=str(f["ordering"]), ts=ts, best=best, limits=limits, **meta_data)
+
+    def __str__(self):
+        lines = []
+        lines.append("Confidence belt for {} ({})".format(self.parname, self.ordering))
+        lines.append("C.L.: {}%".format(self.conf_level))
+        lines.append("Grid: {} points in ({}, {})".format(len(self.grid), self.grid[0], self.grid[-1]))
+        if self.ts is not None:
+            lines.append("Trials per point: {}".format(self.ts.shape[1]))
+        return "\n".join(lines)
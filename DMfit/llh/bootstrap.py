@@ -0,0 +1,104 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import os
+from modeling import PdfView
+
+from .likelihoods import LikelihoodRatioTest
+from .spec import LikelihoodSpec
+from utils.arraystore import ArrayStore, ArrayHandle, attach
+from utils.numba_functions import process_pool
+
+__all__ = ["template_bootstrap"]
+
+
+def _bootstrap_fits(args):
+    """ Refits a range of replicas of the templates, runs in a worker process (or in place on a clone) """
+    source, blocks, rows, hypothesis, parname_fit, parname_fix, conf_level = args
+    lr = source.build() if isinstance(source, LikelihoodSpec) else source._clone()
+    blocks = {name : attach(block) if isinstance(block, ArrayHandle) else block for name, block in blocks.items()}
+    #Every replica starts from the parameters of the nominal fit, the result does not depend on the split in chunks
+    nominal = {h : [par.value for par in model.parameters.values()] for h, model in lr.models.items()}
+    names = list(lr.models[hypothesis].parameters.keys())
+
+    fval = np.zeros(len(rows))
+    valid = np.zeros(len(rows), dtype=bool)
+    best = np.zeros((len(rows), len(names)))
+    upperlimit = np.full(len(rows), np.nan)
+    for j, i in enumerate(rows):
+        for h, model in lr.models.items():
+            for name, block in blocks.items():
+                if name in model.pdfs.keys():
+                    model.pdfs[name].set_frequencies(block[i], check=False)
+            for par, value in zip(model.parameters.values(), nominal[h]):
+                par.value = value
+        #Views of a roi are renormalized on the replicas
+        lr.roi = lr.roi
+
+        result = lr.fit(hypothesis)
+        fval[j], valid[j] = result.fval, result.valid
+        best[j] = [lr.models[hypothesis].parameters[name].value for name in names]
+        if parname_fit is not None:
+            upperlimit[j] = lr.upperlimit_llhinterval(parname_fit, parname_fix, conf_level)
+    return fval, valid, best, upperlimit
+
+
+def template_bootstrap(lr, n_boot, pdfs = None, hypothesis = "H1", parname_fit = None, parname_fix = None, conf_level = 90,
+                       nprocesses = None, chunksize = None, seed = None) -> dict:
+    """ Propagates the MC statistical uncertainty of the templates (errors2) into the fit and the limits
+
+    Every template in pdfs (names, default every static pdf with errors2) is fluctuated n_boot
+    times as one block (PdfBase.bootstrap), the same replica of a pdf is used in H0 and H1. For
+    each replica hypothesis is refitted on the data of lr and, if parname_fit is given, the upper
+    limit upperlimit_llhinterval(parname_fit, parname_fix, conf_level) is computed.
+
+    Replicas are split in chunks over a process pool; workers get a LikelihoodSpec and the blocks
+    in shared memory (ArrayStore), nothing is copied per replica. lr needs data loaded and is
+    not modified.
+
+    Returns a dictionary with the minimum -log L ("fval"), "valid", the best fit value of every
+    parameter and the "upperlimit" of every replica (nan without parname_fit).
+    """
+    if parname_fit is not None and parname_fix is None:
+        raise ValueError("Upper limits need the parameter fixed in H0 (parname_fix)")
+    if lr._data is None:
+        raise ValueError("Data has not been loaded yet!")
+    templates = {}
+    for model in lr.models.values():
+        for name, pdf in model.pdfs.items():
+            templates.setdefault(name, pdf)
+    if pdfs is None:
+        pdfs = [name for name, pdf in templates.items() if not pdf.dynamic and not isinstance(pdf, PdfView) and hasattr(pdf, "_errors2")]
+        if len(pdfs) == 0:
+            raise ValueError("No pdf of the models has errors2, there is nothing to resample")
+    for name in pdfs:
+        if name not in templates:
+            raise ValueError("Pdf {} is not in the models".format(name))
+        if isinstance(templates[name], PdfView):
+            raise ValueError("Cannot resample a view of a pdf, resample the full model and select a region with the roi")
+
+    seeds = np.random.SeedSequence(seed).spawn(len(pdfs))
+    blocks = {name : templates[name].bootstrap(n_boot, np.random.default_rng(s)) for name, s in zip(pdfs, seeds)}
+
+    if nprocesses is None:
+        nprocesses = os.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, int(np.ceil(n_boot / nprocesses)))
+    chunks = [np.arange(start, min(start + chunksize, n_boot)) for start in range(0, n_boot, chunksize)]
+
+    with ArrayStore() as store:
+        if nprocesses == 1:
+            source, handles = lr, blocks
+        else:
+            source, handles = LikelihoodSpec(lr, store), {name : store.put(block) for name, block in blocks.items()}
+        tasks = [(source, handles, rows, hypothesis, parname_fit, parname_fix, conf_level) for rows in chunks]
+        if nprocesses == 1:
+            outputs = list(map(_bootstrap_fits, tasks))
+        else:
+            with process_pool(nprocesses) as pool:
+                outputs = list(pool.map(_bootstrap_fits, tasks))
+
+    fval, valid, best, upperlimit = [np.concatenate(values) for values in zip(*outputs)]
+    result = {"fval" : fval, "valid" : valid, "upperlimit" : upperlimit}
+    for i, name in enumerate(lr.models[hypothesis].parameters.keys()):
+        result[name] = best[:, i]
+    return result
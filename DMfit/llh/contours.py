@@ -0,0 +1,179 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import os
+from scipy import optimize
+
+from .likelihoods import LikelihoodRatioTest
+from .spec import LikelihoodSpec
+from utils.arraystore import ArrayStore
+from utils.numba_functions import process_pool
+
+__all__ = ["profile_contour", "profile_intervals"]
+
+
+def _worker_lr(lr, hypothesis, best):
+    """Copy of lr (or of a LikelihoodSpec) with the data and the parameters of hypothesis set to the best fit"""
+    if isinstance(lr, LikelihoodSpec):
+        new = lr.build()
+    else:
+        new = LikelihoodRatioTest(model=lr.models["H1"], null_model=lr.models["H0"], data=lr.data, roi=lr.roi, **lr.settings())
+    for par, value in zip(new.models[hypothesis].parameters.values(), best):
+        par.value = value
+    return new
+
+
+def _profile(lr, hypothesis, values):
+    """ -log L minimized over the free parameters not in values (a dict name -> value) """
+    model = lr.models[hypothesis]
+    fixed = {}
+    for name, value in values.items():
+        fixed[name] = model.parameters[name].fixed
+        model.parameters[name].value = value
+        model.parameters[name].fixed = True
+    try:
+        if len(model.free_parameters) > 0:
+            fval = lr.fit(hypothesis).fval
+        else:
+            fval = lr.llhs[hypothesis]([par.factor for par in model.parameters.values()])
+    finally:
+        for name, was_fixed in fixed.items():
+            model.parameters[name].fixed = was_fixed
+    return fval
+
+
+def _crossing(function, start, rmax, xtol):
+    """ Smallest r in (0, rmax] with function(r) = 0, function(0) < 0. The bracket search starts at start
+    (the radius of the neighbouring point) and returns rmax if the crossing is beyond the limits."""
+    #Profiles are warm started fits, evaluating twice the same radius can flip the sign of a value
+    #close to 0, so brentq gets the values of the bracket that was found
+    values = {}
+    def g(r):
+        if r not in values:
+            values[r] = function(r)
+        return values[r]
+    r = min(start, rmax)
+    gr = g(r)
+    if gr < 0:
+        low = r
+        while gr < 0:
+            if r >= rmax:
+                return rmax
+            low, r = r, min(2. * r, rmax)
+            gr = g(r)
+        high = r
+    else:
+        high = r
+        while gr >= 0 and r > xtol:
+            high, r = r, r / 2.
+            gr = g(r)
+        #g(0) = -delta at the best fit
+        low = r if gr < 0 else 0.
+    return optimize.brentq(g, low, high, xtol=xtol)
+
+
+def _max_step(par, center, direction):
+    """Largest step along direction that stays within the limits of par"""
+    if direction > 0:
+        return (par.upper_limit - center) / direction
+    elif direction < 0:
+        return (par.lower_limit - center) / direction
+    return np.inf
+
+
+def _contour_points(args):
+    """ Contour points for a block of consecutive angles, each one warm started from the previous """
+    lr, hypothesis, best, fmin, parx, pary, sigmas, angles, delta, xtol = args
+    lr = _worker_lr(lr, hypothesis, best)
+    parameters = lr.models[hypothesis].parameters
+    names = list(parameters.keys())
+    x0, y0 = best[names.index(parx)], best[names.index(pary)]
+
+    points = np.zeros((len(angles), 2))
+    r = 1.
+    for i, angle in enumerate(angles):
+        dx, dy = sigmas[0] * np.cos(angle), sigmas[1] * np.sin(angle)
+        rmax = min(_max_step(parameters[parx], x0, dx), _max_step(parameters[pary], y0, dy))
+        g = lambda r: 2. * (_profile(lr, hypothesis, {parx : x0 + r * dx, pary : y0 + r * dy}) - fmin) - delta
+        r = _crossing(g, r, rmax, xtol)
+        points[i] = x0 + r * dx, y0 + r * dy
+    return points
+
+
+def _interval_end(args):
+    """ Minos-like crossing of one side of the interval of one parameter """
+    lr, hypothesis, best, fmin, parname, sigma, side, delta, xtol = args
+    lr = _worker_lr(lr, hypothesis, best)
+    par = lr.models[hypothesis].parameters[parname]
+    x0 = best[list(lr.models[hypothesis].parameters.keys()).index(parname)]
+    direction = side * sigma
+    g = lambda r: 2. * (_profile(lr, hypothesis, {parname : x0 + r * direction}) - fmin) - delta
+    r = _crossing(g, 1., _max_step(par, x0, direction), xtol)
+    return x0 + r * direction
+
+
+def _best_fit(lr, hypothesis):
+    result = lr.fit(hypothesis)
+    if not result.valid:
+        print("Warning: the fit of {} is not valid, contours are computed around it anyway".format(hypothesis))
+    best = np.array([par.value for par in lr.models[hypothesis].parameters.values()])
+    errors = {par.name : par.error * lr.models[hypothesis].parameters[par.name].scale for par in result.params}
+    return best, result.fval, errors
+
+
+def _map(function, tasks, nprocesses):
+    if nprocesses == 1:
+        return list(map(function, tasks))
+    with process_pool(nprocesses) as pool:
+        return list(pool.map(function, tasks))
+
+
+def profile_contour(lr, parx, pary, hypothesis = "H1", delta = 2.30, npoints = 100, nprocesses = None, xtol = 1e-3):
+    """ Profile likelihood contour of two parameters, 2 * (-log L - min) = delta
+
+    Points are found on a radial grid around the best fit, directions are scaled by
+    the Hesse errors. Angles are split in blocks of consecutive angles over a process
+    pool; within a block each point starts from the radius and the nuisance parameters
+    of its neighbour. lr needs data loaded, the best fit is left in lr.models[hypothesis].
+
+    delta: 2.30 (68%), 4.61 (90%), 5.99 (95%) for two parameters
+    xtol: tolerance on the radius, in units of the errors
+
+    Returns x, y arrays of npoints, closed (last point == first point) ready for plotting.
+    """
+    best, fmin, errors = _best_fit(lr, hypothesis)
+    sigmas = (errors[parx], errors[pary])
+
+    if nprocesses is None:
+        nprocesses = os.cpu_count()
+    angles = np.linspace(0, 2 * np.pi, npoints, endpoint=False)
+    blocks = np.array_split(angles, min(nprocesses, npoints))
+    #Workers get a spec with the templates in shared memory instead of a pickled copy of lr
+    with ArrayStore() as store:
+        source = lr if nprocesses == 1 else LikelihoodSpec(lr, store)
+        tasks = [(source, hypothesis, best, fmin, parx, pary, sigmas, block, delta, xtol) for block in blocks if len(block) > 0]
+        points = np.concatenate(_map(_contour_points, tasks, nprocesses))
+    points = np.vstack([points, points[:1]])
+    return points[:, 0], points[:, 1]
+
+
+def profile_intervals(lr, parnames = None, hypothesis = "H1", delta = 1., nprocesses = None, xtol = 1e-4):
+    """ Minos-equivalent intervals, 2 * (-log L - min) = delta, for several parameters at once.
+    Every (parameter, side) pair runs in its own process. delta = 1 is the 68% interval,
+    2.71 the 90% interval.
+
+    Returns a dictionary name -> (best, lower, upper) with the values of the crossings,
+    an end at a limit of the parameter means there is no crossing inside the limits.
+    """
+    best, fmin, errors = _best_fit(lr, hypothesis)
+    names = list(lr.models[hypothesis].parameters.keys())
+    if parnames is None:
+        parnames = list(lr.models[hypothesis].free_parameters.keys())
+
+    if nprocesses is None:
+        nprocesses = os.cpu_count()
+    with ArrayStore() as store:
+        source = lr if nprocesses == 1 else LikelihoodSpec(lr, store)
+        tasks = [(source, hypothesis, best, fmin, name, errors[name], side, delta, xtol) for name in parnames for side in (-1, 1)]
+        ends = np.reshape(_map(_interval_end, tasks, nprocesses), (len(parnames), 2))
+
+    return {name : (best[names.index(name)], low, high) for name, (low, high) in zip(parnames, ends)}
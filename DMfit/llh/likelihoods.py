@@ -2,20 +2,28 @@ import abc
 from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
 import numpy as np
 import collections
+import copy
 import itertools 
+import concurrent.futures
 from data import DataSet
 from modeling import Model
 from iminuit import Minuit
+import numba
 
-from utils.numba_functions import nb_log, nb_sum, nb_where
+from .minimizers import MinimizerBackend, MINIMIZERS, lockstep_newton
+from utils.numba_functions import nb_poisson_llh, nb_effective_llh, nb_poisson_llh_rows, nb_effective_llh_rows, nb_interpolated_log_density, set_threads, concurrent_safe
 
-LIKELIHOODS = ["Poisson", "Effective"]
+LIKELIHOODS = ["Poisson", "Effective", "Unbinned"]
+#Event densities of the unbinned likelihood: constant in each bin or interpolated between bin centers
+DENSITIES = ["histogram", "linear"]
 
             
 class LikelihoodRatioTest:
-    def __init__(self, model = None, null_model = None, llh_type = "Poisson", data = None, **kwargs):
+    def __init__(self, model = None, null_model = None, llh_type = "Poisson", data = None, roi = None, batch_memory = 2**28, nthreads = None, density = "histogram", minimizer = "minuit", concurrent = False, **kwargs):
 
         self.data = data
+        self._roi = None
+        self._regions = {}
         #Ratio test is H0, H1
         self._models = collections.OrderedDict()
 
@@ -30,6 +38,9 @@ class LikelihoodRatioTest:
         self._llhs = {"H0" : self.llhH0, 
                       "H1" : self.llhH1}
         
+        self._gradients = {"H0" : self.gradH0,
+                           "H1" : self.gradH1}
+        
         self._minimizers = {"H0" : None,
                             "H1" : None}
         
@@ -38,7 +49,17 @@ class LikelihoodRatioTest:
         
         
         self.llh_type = llh_type
+        self.density = density
+        self.minimizer = minimizer
+        #Memory budget in bytes of a (n_points, nbins) block in llh_batch
+        self.batch_memory = batch_memory
+        #Threads of the numba kernels, None uses all cores
+        self.nthreads = nthreads
+        #Fit H0 and H1 at the same time in threads in TS_llhinterval (see fit_concurrent)
+        self.concurrent = concurrent
         self._meta_data = kwargs.copy()
+        
+        self.roi = roi
        
         
 
@@ -80,6 +101,25 @@ class LikelihoodRatioTest:
         self._data = value
     
 
+    @property
+    def roi(self) -> Optional[np.ndarray]:
+        """Flat index of the bins the likelihood is evaluated on, None for all bins"""
+        return self._roi
+    
+    @roi.setter
+    def roi(self, value):
+        """ Region of interest: None (all bins), the name of a roi of the data (DataSet.add_roi)
+        or a flat index of bins. Models are evaluated on views of the templates renormalized
+        to the region, so changing the roi does not copy or rebuild the pdfs."""
+        if value is None:
+            self._roi = None
+            self._regions = {}
+            return
+        if isinstance(value, str):
+            value = self.data.rois[value]
+        self._roi = np.asarray(value)
+        self._regions = {hypothesis : model.region(self._roi) for hypothesis, model in self._models.items()}
+
     @property
     def llh_type(self) -> str:
         return self._llh_type
@@ -91,48 +131,150 @@ class LikelihoodRatioTest:
         else:
             raise ValueError("Likelihood type {} is not implented, available likelihoods are {}".format(value, LIKELIHOODS))
 
+    @property
+    def density(self) -> str:
+        """Event density of the Unbinned likelihood, one of DENSITIES"""
+        return self._density
+    
+    @density.setter
+    def density(self, value: str):
+        if value in DENSITIES:
+            self._density = value
+        else:
+            raise ValueError("Density {} is not implemented, available densities are {}".format(value, DENSITIES))
+
+    @property
+    def minimizer(self) -> MinimizerBackend:
+        return self._minimizer
+    
+    @minimizer.setter
+    def minimizer(self, value):
+        """A MinimizerBackend, or the name of one in MINIMIZERS (e.g. "minuit", "scipy")"""
+        if isinstance(value, MinimizerBackend):
+            self._minimizer = value
+        elif value in MINIMIZERS:
+            self._minimizer = MINIMIZERS[value]()
+        else:
+            raise ValueError("Minimizer {} is not implemented, available minimizers are {}".format(value, list(MINIMIZERS.keys())))
+    
+    def settings(self) -> dict:
+        """ Settings of the likelihood as keyword arguments of the constructor, copies of the test
+        (worker processes, work units, merged bins) are built with them """
+        return {"llh_type" : self._llh_type,
+                "density" : self._density,
+                "minimizer" : self._minimizer,
+                "batch_memory" : self.batch_memory,
+                "nthreads" : self.nthreads,
+                "concurrent" : self.concurrent}
+    
+    @property
+    def has_gradient(self) -> bool:
+        """Analytic gradients are available for the Poisson likelihood (and the unbinned one with histogram density)"""
+        return self._llh_type == "Poisson" or (self._llh_type == "Unbinned" and self._density == "histogram")
         
     def fit(self, hypothesis, **kwargs):
         
-        # kwds = dict()
-        # kwds['errordef'] = Minuit.LIKELIHOOD
-        # kwds['print_level'] = 2.
-        # z = {**kwds, **kwargs}
-        
         #Minimizer work in factor space, not in value space
         
         
         names, init_values, limits, fixed = np.transpose([(par.name, par.factor, par.factor_limits, par.fixed) for par in list(self._models[hypothesis].parameters.values())])
-
-        # self._minimizers[hypothesis] = Minuit.from_array_func(self._llhs[hypothesis], init_values, fix = fixed, limit = limits, name = names, **z)
-        ## Somehow fixed and limits can not be set at the initializer in iminuit version 2.21
-        # self._minimizers[hypothesis] = Minuit(self._llhs[hypothesis], init_values, fixed = fixed, limits = limits, name = names, **z)
         
-        self._minimizers[hypothesis] = Minuit(self._llhs[hypothesis], init_values, name=names)
-        self._minimizers[hypothesis].fixed =  fixed
-        self._minimizers[hypothesis].limits = limits
-        self._minimizers[hypothesis].errordef = Minuit.LIKELIHOOD
-        self._minimizers[hypothesis].print_level = 0
+        gradient, covariance = None, None
+        if self.has_gradient:
+            gradient = self._gradients[hypothesis]
+            covariance = lambda factors, kind = "expected": self._factor_covariance(hypothesis, factors, kind)
+        result = self._minimizer.minimize(self._llhs[hypothesis], init_values, limits, fixed, names, gradient=gradient, covariance=covariance, **kwargs)
+        self._minimizers[hypothesis] = result
 
-        # perform the fit and manually update the parameter in the models to the bestfit
-        mingrad_result = self._minimizers[hypothesis].migrad(**kwargs) 
-        for par in mingrad_result.params:
+        # manually update the parameter in the models to the bestfit
+        for par in result.params:
             self._models[hypothesis].parameters[par.name].value = par.value
 
-        return mingrad_result
+        return result
+    
+    def fit_concurrent(self, hypotheses = ("H0", "H1"), **kwargs) -> dict:
+        """ Fits several hypotheses at the same time, one thread each. Returns hypothesis -> result of fit.
+
+        Each hypothesis has its own model (and region) and its own minimizer entry, and the numba
+        kernels release the GIL, so the fits only share the read-only data. The cores are split
+        between the fits (see _task_threads). With numba's workqueue threading layer, which cannot
+        run parallel kernels from several threads, the fits run one after the other.
+        """
+        hypotheses = list(hypotheses)
+        if len(set(hypotheses)) != len(hypotheses):
+            raise ValueError("Each hypothesis can only be fitted once at a time")
+        if len(hypotheses) < 2 or not concurrent_safe():
+            return {h : self.fit(h, **kwargs) for h in hypotheses}
+        nthreads = self._task_threads(len(hypotheses))
+        
+        def work(hypothesis):
+            set_threads(nthreads)
+            return self.fit(hypothesis, **kwargs)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(hypotheses)) as pool:
+            return dict(zip(hypotheses, pool.map(work, hypotheses)))
+    
+    def _task_threads(self, ntasks) -> int:
+        """Numba threads of each of ntasks concurrent fits: self.nthreads if set, otherwise the cores split between the fits"""
+        if self.nthreads is not None:
+            return self.nthreads
+        return max(1, numba.config.NUMBA_NUM_THREADS // ntasks)
+    
+    def _clone(self):
+        """ Copy with its own models (Model.clone) and minimizers, templates and data are shared """
+        new = copy.copy(self)
+        new._models = collections.OrderedDict([(h, model.clone()) for h, model in self._models.items()])
+        new._llhs = {"H0" : new.llhH0, "H1" : new.llhH1}
+        new._gradients = {"H0" : new.gradH0, "H1" : new.gradH1}
+        new._minimizers = {"H0" : None, "H1" : None}
+        new._meta_data = self._meta_data.copy()
+        new.roi = self._roi
+        return new
+    
+    def fit_batch(self, hypothesis, values, x0 = None, tol = 1e-6, maxiter = 100) -> dict:
+        """ Fits many independent datasets against the same model in lock-step (see lockstep_newton),
+        e.g. the pseudo-experiments of a TS distribution in one go instead of one migrad each
+        
+        values: counts (n_datasets, nbins), in the roi if one is set
+        x0: starting factors (n_datasets, npars), by default the current parameters of the model
+        Returns a dictionary with the minimum -log L of each dataset ("fval"), "converged", "stalled"
+        (the line search found no decrease, the fit stopped before converging), "niter" and the best
+        fit value of each parameter. The parameters of the model are not modified.
+        Needs the analytic gradient (has_gradient).
+        """
+        if not self.has_gradient:
+            raise ValueError("Batched fits need analytic gradients, not available for {} likelihoods".format(self._llh_type))
+        model = self._regions.get(hypothesis, self._models[hypothesis])
+        parameters = list(model.parameters.values())
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        ntotal = np.sum(values, axis=1)
+        
+        if x0 is None:
+            x0 = np.tile([par.factor for par in parameters], (len(values), 1))
+        limits = np.array([par.factor_limits for par in parameters], dtype=float)
+        free = np.array([not par.fixed for par in parameters])
+        
+        def evaluate(factors, rows, derivatives):
+            return self._derivatives(model, factors, values[rows], ntotal[rows], derivatives)
+        
+        fval, best, converged, stalled, niter = lockstep_newton(evaluate, x0, limits[:, 0], limits[:, 1], free, tol=tol, maxiter=maxiter)
+        result = {"fval" : fval, "converged" : converged, "stalled" : stalled, "niter" : niter}
+        for i, par in enumerate(parameters):
+            result[par.name] = best[:, i] * par.scale
+        return result
   
 
     @property
     def minLlhH1(self):
         try:
-            return self.minimizers["H1"].fmin.fval
+            return self.minimizers["H1"].fval
         except:
             raise AttributeError("You need to run .fit('H1') fist")
 
     @property
     def minLlhH0(self):
         try:
-            return self.minimizers["H0"].fmin.fval
+            return self.minimizers["H0"].fval
         except:
             raise AttributeError("You need to run .fit_H0 fist")
 
@@ -142,38 +284,115 @@ class LikelihoodRatioTest:
 
     def TS_llhinterval(self, param_val, parname_fit, parname_fix):
         self.models['H0'].parameters[parname_fix].value = param_val
-        self.fit("H0")
-        self.fit("H1")
+        if self.concurrent:
+            self.fit_concurrent(("H0", "H1"))
+        else:
+            self.fit("H0")
+            self.fit("H1")
         if self.models['H1'].parameters[parname_fit].value > param_val:
             T = 0
         else:    
             T = self.TS
         return T    
             
+    def TS_scan(self, param_vals, parname_fit, parname_fix, nworkers = None) -> np.ndarray:
+        """ TS_llhinterval at several values of parname_fix, the independent conditional fits run
+        at the same time in nworkers threads (default: one per core).
+
+        Each thread works on its own clone of the test (see Model.clone), so the parameters of this
+        test are not modified; the values are split in contiguous blocks and each block is fitted in
+        order, warm started from the previous value.
+        """
+        param_vals = np.atleast_1d(np.asarray(param_vals, dtype=float))
+        if nworkers is None:
+            nworkers = numba.config.NUMBA_NUM_THREADS
+        nworkers = max(1, min(nworkers, len(param_vals)))
+        if not concurrent_safe():
+            nworkers = 1
+        blocks = np.array_split(np.arange(len(param_vals)), nworkers)
+        nthreads = self._task_threads(nworkers)
+        
+        def work(block):
+            set_threads(nthreads)
+            test = self._clone()
+            test.concurrent = False
+            return [test.TS_llhinterval(param_vals[i], parname_fit, parname_fix) for i in block]
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nworkers) as pool:
+            return np.concatenate([np.asarray(ts, dtype=float) for ts in pool.map(work, blocks)])
+            
     def llhH0(self, pars):
         """
         Wrapper function to _llh for Minuit
         
         """
-        return self._llh(pars, model = self._models["H0"])
+        return self._llh(pars, model = self._regions.get("H0", self._models["H0"]))
     
     def llhH1(self, pars):
         """
         Wrapper function to _llh for Minuit
         """
         
-        return self._llh(pars, model = self._models["H1"])
+        return self._llh(pars, model = self._regions.get("H1", self._models["H1"]))
     
+    def gradH0(self, pars):
+        """Analytic gradient of llhH0 in factor space"""
+        return self._gradient(pars, model = self._regions.get("H0", self._models["H0"]))
     
+    def gradH1(self, pars):
+        """Analytic gradient of llhH1 in factor space"""
+        return self._gradient(pars, model = self._regions.get("H1", self._models["H1"]))
+    
+    def _gradient(self, pars, model):
+        values, ntotal = self._region_data()
+        return self._derivatives(model, np.atleast_2d(pars), values[None, :], np.array([ntotal]), True)[1][0]
+    
+    def _derivatives(self, model, factors, values, ntotal, derivatives = True):
+        """ -log L of the Poisson likelihood for rows of factors (n, npars) each with its own data
+        values (n, nbins) and ntotal (n,), with the gradient (n, npars) and the Gauss-Newton
+        approximation of the hessian (n, npars, npars) if derivatives. The model is differentiated
+        with Model.gradient_batch, the parameters of the model are not modified. """
+        if derivatives:
+            mu, dmu = model.gradient_batch(factors)
+        else:
+            mu = model.evaluate_batch(factors)
+        expected = ntotal[:, None] * mu
+        positive = expected > 0
+        safe = np.where(positive, expected, 1.)
+        llh = -np.sum(np.where(positive, values * np.log(safe) - expected, 0.), axis=1)
+        if self._llh_type == "Unbinned":
+            llh += values @ np.log(self._region_volumes())
+        if not derivatives:
+            return llh
+        
+        #d(-log L)/dmu = ntotal * (1 - n / expected), d2/dmu2 = n / mu^2 (the terms in d2mu are dropped)
+        dllh = np.where(positive, ntotal[:, None] * (1. - values / safe), 0.)
+        curvature = np.where(positive, values * (ntotal[:, None] / safe)**2, 0.)
+        gradient = np.einsum("pkb,pb->pk", dmu, dllh)
+        hessian = np.einsum("pkb,pb,plb->pkl", dmu, curvature, dmu)
+        return llh, gradient, hessian
+    
+    
+        
+    def _region_data(self):
+        """Data values and total number of events in the roi"""
+        if self._roi is None:
+            return self._data.values, self._data.ntotal
+        values = self._data.values[self._roi]
+        return values, np.sum(values)
         
     def _llh(self, pars, model = None):
         """ Likelihood evaluation using the numba module 
-            Numba wrappers (see numba_functions.py):
+            Numba kernels (see numba_functions.py):
             
-            nb_log -> np.log 
-            nb_where -> np.where
-            nb_sum -> np.sum
+            nb_poisson_llh -> Poisson likelihood, bins with no expectation are skipped
+            nb_effective_llh -> effective likelihood, with the MC variance propagated
+                                from the errors2 of the pdfs (Model.variance)
+            nb_interpolated_log_density -> unbinned likelihood over events (see _unbinned_llh)
             
+            Both are parallel reductions with a fixed summation order, the result
+            does not depend on the number of threads (self.nthreads). The kernels release
+            the GIL, fits of H0 and H1 can run in threads (fit_concurrent, TS_scan).
             --------------------
             Note: as numba needs to compile in time first call will be slower than usual.
         """
@@ -194,12 +413,158 @@ class LikelihoodRatioTest:
         for z, p in zip(iter(model.parameters.values()), pars):
             z.factor = p
         
-        mask = np.where(model[:] > 0)
+        values, ntotal = self._region_data()
+        
+        if self.nthreads is not None:
+            set_threads(self.nthreads)
+        
+        expected = ntotal * model[:]
+        if self._llh_type == "Poisson":
+            return nb_poisson_llh(values, expected)
+        elif self._llh_type == "Effective":
+            return nb_effective_llh(values, expected, ntotal**2 * model.variance())
+        else:
+            return self._unbinned_llh(values, expected)
+    
+    def _region_volumes(self):
+        """Bin volumes in the roi"""
+        volumes = self._data.binning.volumes
+        return volumes if self._roi is None else volumes[self._roi]
+    
+    def _unbinned_llh(self, values, expected):
+        """ Extended unbinned likelihood, -log L = N_exp - sum_events log(N_exp p(x_e))
+        where N_exp p(x) = expected / bin volume is the density of events of the model.
+        
+        - "histogram": the density is constant in each bin, so the sum over events is done once
+          per bin with the cached event counts. It is the binned Poisson likelihood up to the
+          constant sum_b n_b log(V_b), without the resolution loss only if the bins are fine.
+        - "linear": the density is interpolated multilinearly between bin centers at the position
+          of each event, and summed over chunks of the cached event lookups (memory does not grow
+          with the number of events). The interpolation does not keep the normalization exactly,
+          N_exp is the sum of the expected counts. Not available with a roi.
+        """
+        volumes = self._region_volumes()
+        if self._density == "histogram":
+            return nb_poisson_llh(values, expected) + np.dot(values, np.log(volumes))
+        
+        if self._roi is not None:
+            raise ValueError("Linear density is not available on a region of interest")
+        index, fraction = self._data.event_interpolation
+        shape = np.asarray(self._data.binning.shape)
+        strides = np.append(np.cumprod(shape[:0:-1])[::-1], 1).astype(np.int64)
+        density = expected / volumes
+        logsum = 0.
+        for start in range(0, len(index), self._data.chunksize):
+            stop = start + self._data.chunksize
+            logsum += nb_interpolated_log_density(density, strides, index[start:stop], fraction[start:stop])
+        return np.sum(expected) - logsum
+    
+    
+    def llh_batch(self, hypothesis, pars, batch_memory = None):
+        """ -log L of a hypothesis for many parameter vectors, without side effects
+
+        pars: array (n_points, npars) in factor space, columns ordered as the parameters of the model
+        Returns an array of n_points values, each equal to llhH0/llhH1 of the row.
+
+        The model is evaluated as (chunk, nbins) blocks, the chunk size is set so that a block
+        takes about batch_memory bytes (default: self.batch_memory). The parameters of the
+        models are not modified.
+        """
+        pars = np.atleast_2d(np.asarray(pars, dtype=float))
+        if np.any(np.isnan(pars)):
+            raise ValueError("One of the pass parameters is a nan")
+        
+        model = self._regions.get(hypothesis, self._models[hypothesis])
+        values, ntotal = self._region_data()
+        
+        if self.nthreads is not None:
+            set_threads(self.nthreads)
+        
+        if batch_memory is None:
+            batch_memory = self.batch_memory
+        #A handful of temporaries of the block size are alive at the same time
+        chunk = max(1, int(batch_memory // (4 * 8 * len(values))))
+        
+        llhs = np.empty(len(pars))
+        for start in range(0, len(pars), chunk):
+            block = pars[start:start + chunk]
+            expected = ntotal * model.evaluate_batch(block)
+            if self._llh_type == "Poisson":
+                llhs[start:start + chunk] = nb_poisson_llh_rows(values, expected)
+            elif self._llh_type == "Unbinned":
+                if self._density == "histogram":
+                    llhs[start:start + chunk] = nb_poisson_llh_rows(values, expected) + np.dot(values, np.log(self._region_volumes()))
+                else:
+                    llhs[start:start + chunk] = [self._unbinned_llh(values, row) for row in expected]
+            else:
+                variance = ntotal**2 * model.variance(factors=block)
+                llhs[start:start + chunk] = nb_effective_llh_rows(values, expected, variance)
+        return llhs
+    
+    def fisher_information(self, hypothesis = "H1", kind = "observed", factors = None) -> np.ndarray:
+        """ Fisher information (npars, npars) of the Poisson likelihood, in factor space, in closed form
+        from the templates and the derivatives of the model (Model.gradient_batch/hessian_batch):
+        
+        expected: I_jk = N sum_b dmu_b/dj dmu_b/dk / mu_b
+        observed: I_jk = sum_b n_b / mu_b^2 dmu_b/dj dmu_b/dk + (N - n_b / mu_b) d2mu_b/djdk,
+                  the hessian of -log L (what Hesse estimates numerically at the minimum)
+        
+        factors: point in factor space, by default the current parameters of the model.
+        """
+        if not self.has_gradient:
+            raise ValueError("The Fisher information is only available in closed form for Poisson likelihoods")
+        if kind not in ["expected", "observed"]:
+            raise ValueError("Kind of Fisher information {} is not implemented, available kinds are ['expected', 'observed']".format(kind))
+        model = self._regions.get(hypothesis, self._models[hypothesis])
+        if factors is None:
+            factors = [par.factor for par in model.parameters.values()]
+        values, ntotal = self._region_data()
+        
+        if kind == "expected":
+            mu, dmu = model.gradient_batch(factors)
+        else:
+            mu, dmu, d2mu = model.hessian_batch(factors)
+        mu, dmu = mu[0], dmu[0]
+        positive = mu > 0
+        safe = np.where(positive, mu, 1.)
+        if kind == "expected":
+            return ntotal * np.einsum("jb,b,kb->jk", dmu, np.where(positive, 1. / safe, 0.), dmu)
+        information = np.einsum("jb,b,kb->jk", dmu, np.where(positive, values / safe**2, 0.), dmu)
+        return information + np.einsum("jkb,b->jk", d2mu[0], np.where(positive, ntotal - values / safe, 0.))
+    
+    def _factor_covariance(self, hypothesis, factors = None, kind = "observed") -> np.ndarray:
+        #Inverse of the Fisher information on the free parameters, 0 for the fixed ones
+        free = np.array([not par.fixed for par in self._models[hypothesis].parameters.values()])
+        information = self.fisher_information(hypothesis, kind, factors)
+        covariance = np.zeros_like(information)
+        try:
+            covariance[np.ix_(free, free)] = np.linalg.inv(information[np.ix_(free, free)])
+        except np.linalg.LinAlgError:
+            raise ValueError("Fisher information of {} is singular, some parameters are not constrained".format(hypothesis))
+        return covariance
+    
+    def covariance(self, hypothesis = "H1", kind = "observed") -> np.ndarray:
+        """ Covariance matrix of the parameters in value space, inverse of the Fisher information
+        (see fisher_information) at the current parameters, usually the best fit. A fast alternative
+        to Hesse, rows and columns of fixed parameters are 0."""
+        scales = np.array([par.scale for par in self._models[hypothesis].parameters.values()])
+        return self._factor_covariance(hypothesis, kind=kind) * np.outer(scales, scales)
     
-        logs = np.asarray(list(map(nb_log, self._data.ntotal * np.asarray(model[mask]))))
-      
-        return -nb_sum(self._data.values[mask] * logs - self._data.ntotal * model[mask])
+    def errors(self, hypothesis = "H1", kind = "observed") -> collections.OrderedDict:
+        """Parabolic errors of the parameters from the analytic covariance, name -> error"""
+        errors = np.sqrt(np.abs(np.diag(self.covariance(hypothesis, kind))))
+        return collections.OrderedDict(zip(self._models[hypothesis].parameters.keys(), errors))
     
+    def merge(self, merging):
+        """ LikelihoodRatioTest on merged bins (a BinMerging, see BinMerging.build). Templates and
+        data are merged once, trials and scans on the new test run on the merged bins. """
+        if self._roi is not None:
+            raise ValueError("Merge the bins without a roi, the roi is defined on the original bins")
+        if self._llh_type == "Unbinned":
+            raise ValueError("Merged bins have no volume, the unbinned likelihood cannot be merged")
+        data = merging.dataset(self._data) if self._data is not None else None
+        return LikelihoodRatioTest(model=merging.model(self._models["H1"]), null_model=merging.model(self._models["H0"]),
+                                   data=data, **self.settings(), **self._meta_data)
     
     def upperlimit(self):
         
@@ -0,0 +1,273 @@
+import abc
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import collections
+import time
+from iminuit import Minuit
+from scipy import optimize
+
+__all__ = ["MinimizerBackend", "MinuitBackend", "ScipyBackend", "FitResult", "MINIMIZERS", "lockstep_newton", "benchmark"]
+
+
+FitParam = collections.namedtuple("FitParam", ["name", "value", "error", "is_fixed"])
+
+
+class FitResult():
+    """ Result of a fit by a backend other than Minuit, with the attributes of Minuit that
+    are used in the package: fval, valid, nfcn, values and params (name, value, error) """
+
+    def __init__(self, fval, values, errors, names, fixed, valid, nfcn, message = ""):
+        self.fval = float(fval)
+        self.values = np.asarray(values, dtype=float)
+        self.errors = np.asarray(errors, dtype=float)
+        self.valid = bool(valid)
+        self.nfcn = int(nfcn)
+        self.message = str(message)
+        self.params = [FitParam(*p) for p in zip(names, self.values, self.errors, fixed)]
+
+    def __str__(self):
+        lines = []
+        lines.append("FitResult: fval = {}, valid = {}, nfcn = {}".format(self.fval, self.valid, self.nfcn))
+        for par in self.params:
+            lines.append(" - {} = {} +- {}{}".format(par.name, par.value, par.error, " (fixed)" if par.is_fixed else ""))
+        return "\n".join(lines)
+
+
+class MinimizerBackend(abc.ABC):
+    """ Minimizer of a -log L in factor space, used by LikelihoodRatioTest.fit
+
+    minimize returns an object with fval, valid and params (each with name, value, error).
+    gradient is the analytic gradient of function when the likelihood provides one, None otherwise,
+    and covariance(x, kind) the analytic covariance ("expected" or "observed") in factor space.
+    """
+
+    @abc.abstractmethod
+    def minimize(self, function, x0, limits, fixed, names, gradient = None, covariance = None, **kwargs):
+        pass
+
+
+class MinuitBackend(MinimizerBackend):
+    """ iminuit migrad (default). The gradient is only passed to Minuit with use_gradient,
+    by default Minuit computes its own numerical derivatives. With seed_errors the initial
+    step sizes are the errors from the analytic (expected) covariance at the starting point:
+    iminuit has no input for a full hessian, so the seed is its diagonal. Returns the Minuit object."""
+
+    def __init__(self, use_gradient = False, seed_errors = False):
+        self.use_gradient = use_gradient
+        self.seed_errors = seed_errors
+
+    def minimize(self, function, x0, limits, fixed, names, gradient = None, covariance = None, **kwargs):
+        grad = gradient if self.use_gradient else None
+        ## Somehow fixed and limits can not be set at the initializer in iminuit version 2.21
+        minimizer = Minuit(function, x0, grad=grad, name=names)
+        minimizer.fixed = fixed
+        minimizer.limits = limits
+        if self.seed_errors and covariance is not None:
+            try:
+                errors = np.sqrt(np.abs(np.diag(covariance(np.asarray(x0, dtype=float), "expected"))))
+                for i, error in enumerate(errors):
+                    if np.isfinite(error) and error > 0:
+                        minimizer.errors[i] = error
+            except ValueError:
+                pass
+        minimizer.errordef = Minuit.LIKELIHOOD
+        minimizer.print_level = 0
+        return minimizer.migrad(**kwargs)
+
+
+class ScipyBackend(MinimizerBackend):
+    """ Bounded quasi-Newton (scipy L-BFGS-B) with the analytic gradient when available,
+    finite differences otherwise. Much lighter than migrad when only the minimum is needed
+    (e.g. the TS of pseudo-experiments). With errors, parabolic errors are computed from the
+    analytic covariance at the minimum when available, from the hessian by finite differences
+    otherwise; without errors they are 0."""
+
+    def __init__(self, method = "L-BFGS-B", errors = True, **options):
+        self.method = method
+        self.errors = errors
+        self.options = options
+
+    def minimize(self, function, x0, limits, fixed, names, gradient = None, covariance = None, **kwargs):
+        x0 = np.asarray(x0, dtype=float)
+        fixed = np.asarray(fixed, dtype=bool)
+        free = ~fixed
+        full = x0.copy()
+
+        def fun(x):
+            full[free] = x
+            return function(full)
+
+        jac = None
+        if gradient is not None:
+            def jac(x):
+                full[free] = x
+                return np.asarray(gradient(full))[free]
+
+        bounds = [tuple(l) for l, f in zip(limits, fixed) if not f]
+        result = optimize.minimize(fun, x0[free], jac=jac, bounds=bounds, method=self.method, options=dict(self.options, **kwargs))
+
+        values = x0.copy()
+        values[free] = result.x
+        errors = np.zeros(len(x0))
+        if self.errors and np.any(free):
+            try:
+                errors = np.sqrt(np.abs(np.diag(covariance(values, "observed"))))
+            except (TypeError, ValueError):
+                #No analytic covariance (None) or singular
+                errors[free] = self._errors(fun, jac, result.x)
+        #Leaves the parameters of the model at the minimum, as migrad does
+        fval = function(values)
+        return FitResult(fval, values, errors, names, fixed, result.success, result.nfev, result.message)
+
+
+    @staticmethod
+    def _errors(fun, jac, x, eps = 1e-5):
+        """Square root of the diagonal of the inverse hessian (errordef 0.5 of a -log L)"""
+        k = len(x)
+        steps = eps * np.maximum(np.abs(x), 1.)
+        hessian = np.zeros((k, k))
+        if jac is not None:
+            for i in range(k):
+                dx = np.zeros(k)
+                dx[i] = steps[i]
+                hessian[i] = (jac(x + dx) - jac(x - dx)) / (2 * steps[i])
+        else:
+            for i in range(k):
+                for j in range(i, k):
+                    di, dj = np.zeros(k), np.zeros(k)
+                    di[i], dj[j] = steps[i], steps[j]
+                    hessian[i, j] = hessian[j, i] = (fun(x + di + dj) - fun(x + di - dj) - fun(x - di + dj) + fun(x - di - dj)) / (4 * steps[i] * steps[j])
+        hessian = 0.5 * (hessian + hessian.T)
+        try:
+            return np.sqrt(np.abs(np.diag(np.linalg.inv(hessian))))
+        except np.linalg.LinAlgError:
+            return np.full(k, np.nan)
+
+
+MINIMIZERS = {"minuit" : MinuitBackend,
+              "scipy" : ScipyBackend}
+
+
+def lockstep_newton(evaluate, x0, lower, upper, free, tol = 1e-6, maxiter = 100):
+    """ Minimizes many independent problems of the same dimension in lock-step, with a
+    projected Gauss-Newton method on the box lower <= x <= upper
+
+    evaluate(x, rows, derivatives) takes x (m, k) for the problems rows (m,) and returns f (m,),
+    plus the gradient (m, k) and a positive (semi-)definite approximation of the hessian (m, k, k)
+    if derivatives.
+    Every iteration is one batched evaluation with derivatives and a few without for the
+    backtracking line search, for all the problems that did not converge yet.
+    free: boolean (k,) mask of the parameters that are minimized.
+
+    Returns the minima f (n,), x (n, k), a converged mask (n,), a stalled mask (n,) and the
+    number of iterations (n,). Stalled problems are the ones whose line search found no decrease
+    along the step: they are stopped at the last point, which is not a converged minimum.
+    """
+    x = np.array(x0, dtype=float)
+    n, k = x.shape
+    lower = np.broadcast_to(np.asarray(lower, dtype=float), (n, k))
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), (n, k))
+    x = np.clip(x, lower, upper)
+    f = np.asarray(evaluate(x, np.arange(n), False), dtype=float)
+    converged = np.zeros(n, dtype=bool)
+    stalled = np.zeros(n, dtype=bool)
+    niter = np.zeros(n, dtype=int)
+    eye = np.eye(k)
+
+    for iteration in range(maxiter):
+        active = np.flatnonzero(~(converged | stalled))
+        if len(active) == 0:
+            break
+        niter[active] += 1
+        xa = x[active]
+        fa, grad, hessian = evaluate(xa, active, True)
+
+        #Parameters at a bound with the gradient pushing outwards are held, as the fixed ones
+        held = ~free[None, :] | ((xa <= lower[active]) & (grad > 0)) | ((xa >= upper[active]) & (grad < 0))
+        grad = np.where(held, 0., grad)
+        hessian = np.where(held[:, :, None] | held[:, None, :], 0., hessian) + held[:, :, None] * eye
+        #Small damping keeps the step defined for flat directions
+        hessian = hessian + 1e-10 * np.trace(hessian, axis1=1, axis2=2)[:, None, None] * eye
+        step = np.linalg.solve(hessian, grad[:, :, None])[:, :, 0]
+
+        #Backtracking line search on the projected step
+        t = np.ones(len(active))
+        accepted = np.zeros(len(active), dtype=bool)
+        fnew = fa.copy()
+        xnew = xa.copy()
+        for _ in range(30):
+            todo = np.flatnonzero(~accepted)
+            if len(todo) == 0:
+                break
+            trial = np.clip(xa[todo] - t[todo, None] * step[todo], lower[active][todo], upper[active][todo])
+            ftrial = np.asarray(evaluate(trial, active[todo], False), dtype=float)
+            better = ftrial <= fa[todo] + 1e-12 * np.abs(fa[todo])
+            xnew[todo[better]] = trial[better]
+            fnew[todo[better]] = ftrial[better]
+            accepted[todo[better]] = True
+            t[todo[~better]] *= 0.5
+
+        moved = np.max(np.abs(xnew - xa), axis=1)
+        converged[active] = accepted & (fa - fnew < tol) & (moved < np.sqrt(tol))
+        stalled[active] = ~accepted
+        x[active] = xnew
+        f[active] = fnew
+
+    return f, x, converged, stalled, niter
+
+
+def benchmark(lr, ntotal, ntrials = 100, backends = None, lockstep = True, seed = None, verbose = True):
+    """ Compares minimizer backends on ntrials pseudo-experiments sampled from H0 at its
+    current parameter values: total fit time (H0 + H1) and agreement of the TS with the
+    first backend. lockstep adds LikelihoodRatioTest.fit_batch on the same datasets.
+
+    backends: dict name -> MinimizerBackend (default: Minuit and L-BFGS-B)
+    Returns a dictionary name -> {"time", "ts", "max_dts"}. The minimizer and the parameters
+    of lr are restored at the end.
+    """
+    from data import DataSet
+
+    if backends is None:
+        backends = collections.OrderedDict([("minuit", MinuitBackend()), ("scipy", ScipyBackend())])
+    rng = np.random.default_rng(seed)
+    samples = rng.poisson(ntotal * lr.models["H0"][:], size=(ntrials, len(lr.models["H0"])))
+
+    previous_minimizer, previous_data = lr.minimizer, lr._data
+    start = {h : [par.value for par in model.parameters.values()] for h, model in lr.models.items()}
+
+    def reset():
+        for h, model in lr.models.items():
+            for par, value in zip(model.parameters.values(), start[h]):
+                par.value = value
+
+    results = collections.OrderedDict()
+    try:
+        for name, backend in backends.items():
+            reset()
+            lr.minimizer = backend
+            ts = np.zeros(ntrials)
+            t0 = time.perf_counter()
+            for i, values in enumerate(samples):
+                lr.data = DataSet(values=values, binning=lr.models["H0"].binning)
+                lr.fit("H0")
+                lr.fit("H1")
+                ts[i] = lr.TS
+            results[name] = {"time" : time.perf_counter() - t0, "ts" : ts}
+
+        if lockstep:
+            reset()
+            t0 = time.perf_counter()
+            fits = {h : lr.fit_batch(h, samples) for h in ("H0", "H1")}
+            ts = 2 * (fits["H0"]["fval"] - fits["H1"]["fval"])
+            results["lockstep"] = {"time" : time.perf_counter() - t0, "ts" : ts}
+    finally:
+        lr.minimizer = previous_minimizer
+        lr.data = previous_data
+        reset()
+
+    reference = next(iter(results.values()))["ts"]
+    for name, result in results.items():
+        result["max_dts"] = float(np.max(np.abs(result["ts"] - reference)))
+        if verbose:
+            print("{:>10}: {:8.3f} s for {} trials, max |dTS| = {:.2e}".format(name, result["time"], ntrials, result["max_dts"]))
+    return results
@@ -0,0 +1,189 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import collections
+
+__all__ = ["EnsembleSampler"]
+
+
+def autocorrelation_time(chain, c = 5.):
+    """ Integrated autocorrelation time of each parameter of an ensemble chain (nsteps, nwalkers, npars).
+    The autocorrelation function is averaged over walkers (computed with FFTs) and summed up
+    to the first window M with M >= c * tau (Sokal)."""
+    nsteps = chain.shape[0]
+    x = chain - np.mean(chain, axis=0)
+    n = 1 << int(np.ceil(np.log2(2 * nsteps)))
+    f = np.fft.rfft(x, n=n, axis=0)
+    acf = np.fft.irfft(f * np.conjugate(f), n=n, axis=0)[:nsteps].mean(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        acf = acf / acf[0]
+    taus = 2. * np.cumsum(acf, axis=0) - 1.
+    tau = np.empty(chain.shape[2])
+    for i in range(chain.shape[2]):
+        window = np.arange(nsteps) >= c * taus[:, i]
+        tau[i] = taus[np.argmax(window), i] if np.any(window) else taus[-1, i]
+    return tau
+
+
+class EnsembleSampler():
+    """ Affine-invariant ensemble sampler (Goodman & Weare stretch move) of the posterior of a hypothesis
+
+    Posterior = L(data | pars) x prod(priors), priors are taken from Parameter.prior
+    (flat within the limits if not set). Only the free parameters are sampled, fixed
+    parameters stay at their current value.
+
+    Walkers are split in two halves that are moved in turn against the other half;
+    each half step is one call to LikelihoodRatioTest.llh_batch for all its walkers,
+    so a full step costs two batched evaluations whatever the number of walkers.
+    The sampler does not modify the parameters of the models.
+    """
+
+    def __init__(self, lr, hypothesis = "H1", nwalkers = 32, a = 2., seed = None):
+        model = lr.models[hypothesis]
+        self._lr = lr
+        self._hypothesis = hypothesis
+        self._parameters = list(model.parameters.values())
+        self._free = np.array([not par.fixed for par in self._parameters])
+        self._scales = np.array([par.scale for par in self._parameters])
+        if nwalkers < 2 * np.sum(self._free) or nwalkers % 2 != 0:
+            raise ValueError("Number of walkers needs to be even and at least twice the number of free parameters")
+        self.nwalkers = nwalkers
+        self.a = a
+        self._rng = np.random.default_rng(seed)
+
+        self._chain = None
+        self._log_prob = None
+        self._naccepted = np.zeros(nwalkers)
+        self._nsteps = 0
+
+    @property
+    def names(self) -> list:
+        """Names of the sampled (free) parameters"""
+        return [par.name for par, free in zip(self._parameters, self._free) if free]
+
+    @property
+    def ndim(self) -> int:
+        return int(np.sum(self._free))
+
+    def log_prob(self, points):
+        """ Log posterior of points (n, ndim) in value space of the free parameters """
+        points = np.atleast_2d(points)
+        values = np.tile([par.value for par in self._parameters], (len(points), 1))
+        values[:, self._free] = points
+
+        logp = np.zeros(len(points))
+        for i, par in enumerate(self._parameters):
+            if self._free[i]:
+                logp += par.log_prior(values[:, i])
+        inside = np.isfinite(logp)
+        if np.any(inside):
+            logp[inside] -= self._lr.llh_batch(self._hypothesis, values[inside] / self._scales)
+        return logp
+
+    def initial_state(self, spread = 1e-3):
+        """ Small ball around the current values of the parameters, spread in units of the range of the limits """
+        center = np.array([par.value for par in self._parameters])[self._free]
+        limits = np.array([par.limits for par in self._parameters])[self._free]
+        width = spread * (limits[:, 1] - limits[:, 0])
+        points = center + width * self._rng.standard_normal((self.nwalkers, self.ndim))
+        return np.clip(points, limits[:, 0], limits[:, 1])
+
+    def _half_step(self, points, logp, moving, others):
+        """Stretch move of the walkers in moving using the walkers in others"""
+        n = len(moving)
+        z = ((self.a - 1.) * self._rng.random(n) + 1.)**2 / self.a
+        partners = points[others[self._rng.integers(len(others), size=n)]]
+        proposal = partners + z[:, None] * (points[moving] - partners)
+        logp_new = self.log_prob(proposal)
+        log_ratio = (self.ndim - 1.) * np.log(z) + logp_new - logp[moving]
+        accept = np.log(self._rng.random(n)) < log_ratio
+        points[moving[accept]] = proposal[accept]
+        logp[moving[accept]] = logp_new[accept]
+        self._naccepted[moving[accept]] += 1
+
+    def run(self, nsteps, initial = None, chain_file = None, flush_every = 100):
+        """ Runs nsteps of the ensemble
+
+        - initial: (nwalkers, ndim) starting points in value space, by default a small ball
+          around the current parameter values (a best fit is a good start)
+        - chain_file: if given the chain is streamed to chain_file (.npy, shape (nsteps, nwalkers, ndim))
+          and the log posterior to the same name with _logprob, both as memory-mapped arrays
+          flushed to disk every flush_every steps
+        Returns the chain (nsteps, nwalkers, ndim).
+        """
+        points = self.initial_state() if initial is None else np.array(initial, dtype=float)
+        if points.shape != (self.nwalkers, self.ndim):
+            raise ValueError("Initial state needs a shape {}".format((self.nwalkers, self.ndim)))
+        logp = self.log_prob(points)
+        if not np.all(np.isfinite(logp)):
+            raise ValueError("Initial state has walkers outside the support of the posterior")
+
+        shape = (nsteps, self.nwalkers, self.ndim)
+        if chain_file is None:
+            chain = np.empty(shape)
+            log_probs = np.empty(shape[:2])
+        else:
+            base = chain_file[:-4] if chain_file.endswith(".npy") else chain_file
+            chain = np.lib.format.open_memmap(base + ".npy", mode="w+", shape=shape)
+            log_probs = np.lib.format.open_memmap(base + "_logprob.npy", mode="w+", shape=shape[:2])
+
+        self._naccepted = np.zeros(self.nwalkers)
+        halves = np.array_split(self._rng.permutation(self.nwalkers), 2)
+        for step in range(nsteps):
+            self._half_step(points, logp, halves[0], halves[1])
+            self._half_step(points, logp, halves[1], halves[0])
+            chain[step] = points
+            log_probs[step] = logp
+            if chain_file is not None and (step + 1) % flush_every == 0:
+                chain.flush()
+                log_probs.flush()
+        if chain_file is not None:
+            chain.flush()
+            log_probs.flush()
+
+        self._chain = chain
+        self._log_prob = log_probs
+        self._nsteps = nsteps
+        return chain
+
+    @property
+    def chain(self) -> np.ndarray:
+        return self._chain
+
+    @property
+    def log_probability(self) -> np.ndarray:
+        return self._log_prob
+
+    @property
+    def acceptance_fraction(self) -> np.ndarray:
+        return self._naccepted / max(self._nsteps, 1)
+
+    def samples(self, burn = None, thin = 1) -> np.ndarray:
+        """ Flat samples (n, ndim), by default the first half of the chain is dropped as burn-in """
+        if burn is None:
+            burn = self._nsteps // 2
+        return np.reshape(self._chain[burn::thin], (-1, self.ndim))
+
+    def diagnostics(self, burn = None) -> dict:
+        """ Convergence diagnostics: integrated autocorrelation time per parameter, number of
+        independent samples and acceptance fraction. The chain is considered converged when it is
+        longer than 50 autocorrelation times (after burn-in)."""
+        if burn is None:
+            burn = self._nsteps // 2
+        chain = np.asarray(self._chain[burn:])
+        tau = autocorrelation_time(chain)
+        return {"tau" : collections.OrderedDict(zip(self.names, tau)),
+                "n_effective" : chain.shape[0] * chain.shape[1] / np.max(tau),
+                "acceptance_fraction" : float(np.mean(self.acceptance_fraction)),
+                "converged" : bool(chain.shape[0] > 50 * np.max(tau))}
+
+    def upperlimit(self, parname, conf_level = 90, burn = None, thin = 1) -> float:
+        """Bayesian upper limit: conf_level percentile of the marginal posterior of parname"""
+        samples = self.samples(burn, thin)[:, self.names.index(parname)]
+        return float(np.percentile(samples, conf_level))
+
+    def __str__(self):
+        lines = []
+        lines.append("EnsembleSampler of {} with {} walkers".format(self._hypothesis, self.nwalkers))
+        lines.append("Sampled parameters: {}".format(self.names))
+        lines.append("Steps: {}".format(self._nsteps))
+        return "\n".join(lines)
@@ -0,0 +1,88 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import collections
+from data import DataSet
+from modeling import Model
+
+from .likelihoods import LikelihoodRatioTest
+from utils.arraystore import ArrayStore, ArrayHandle, attach
+
+__all__ = ["ModelSpec", "LikelihoodSpec"]
+
+
+def _export_pdf(pdf, store):
+    #State of the pdf with every array replaced by a handle in the store
+    state = {}
+    for key, value in pdf.__dict__.items():
+        state[key] = store.put(value) if isinstance(value, np.ndarray) else value
+    return pdf.__class__, state
+
+
+def _build_pdf(cls, state):
+    pdf = cls.__new__(cls)
+    for key, value in state.items():
+        pdf.__dict__[key] = attach(value) if isinstance(value, ArrayHandle) else value
+    return pdf
+
+
+class ModelSpec():
+    """ Compact picklable description of a Model: expression, parameter table and handles to
+    the template arrays in an ArrayStore. build() makes the Model again in any process that
+    can attach the store, templates are shared read-only and not copied. """
+
+    def __init__(self, model, store):
+        self.meta_data = model.meta_data.copy()
+        self.parameters = [par.copy() for par in model.parameters.values()]
+        self.pdfs = [_export_pdf(pdf, store) for pdf in model.pdfs.values()]
+
+    def build(self) -> Model:
+        pdfs = [_build_pdf(cls, state) for cls, state in self.pdfs]
+        return Model(pdfs=pdfs, parameters=self.parameters, **self.meta_data)
+
+
+class LikelihoodSpec():
+    """ Compact picklable description of a LikelihoodRatioTest for worker processes
+
+    Pickling a LikelihoodRatioTest sends both models with all their templates (and the
+    minimizers) to every worker. The spec only holds the expressions, the parameter tables,
+    the settings of the likelihood and handles to the arrays (templates and data values) put
+    in an ArrayStore, shared memory or memory-mapped files; workers attach them zero-copy, e.g.
+
+    with ArrayStore() as store:
+        spec = LikelihoodSpec(lr, store)
+        with process_pool(n) as pool:
+            pool.map(work, [spec] * n)      #work calls spec.build()
+
+    The store needs to stay open while the workers use the spec. Event lists of unbinned
+    datasets are not exported, only the histogram of the data.
+    """
+
+    def __init__(self, lr, store, data = True):
+        self.models = collections.OrderedDict([(h, ModelSpec(model, store)) for h, model in lr.models.items()])
+        self.settings = lr.settings()
+        self.meta_data = lr.meta_data.copy()
+        self.roi = lr.roi
+
+        self.data = None
+        if data and lr._data is not None:
+            if lr.llh_type == "Unbinned" and lr.density == "linear":
+                raise ValueError("Event lists are not exported, a spec cannot evaluate a linear density")
+            ds = lr.data
+            self.data = {"values" : store.put(np.asarray(ds.values, dtype=float)),
+                         "binning" : ds.binning,
+                         "data_type" : ds.data_type,
+                         "rois" : ds.rois}
+
+    def build_data(self) -> Optional[DataSet]:
+        if self.data is None:
+            return None
+        ds = DataSet(data_type=self.data["data_type"], binning=self.data["binning"])
+        ds.values = attach(self.data["values"])
+        ds.rois.update(self.data["rois"])
+        return ds
+
+    def build(self) -> LikelihoodRatioTest:
+        """A LikelihoodRatioTest equivalent to the exported one, with the templates attached from the store"""
+        models = {h : spec.build() for h, spec in self.models.items()}
+        return LikelihoodRatioTest(model=models["H1"], null_model=models["H0"], data=self.build_data(),
+                                   roi=self.roi, **self.settings, **self.meta_data)
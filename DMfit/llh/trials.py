@@ -0,0 +1,72 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+from data import DataSet
+
+from .likelihoods import LikelihoodRatioTest
+from utils.numba_functions import nb_seed
+
+__all__ = ["run_trials", "run_scan", "submit_trials", "submit_scan"]
+
+
+def _fresh(lr):
+    """Copy of a LikelihoodRatioTest without minimizers, so it is cheap to pickle into a work queue job"""
+    return LikelihoodRatioTest(model=lr.models["H1"], null_model=lr.models["H0"], roi=lr.roi, **lr.settings(), **lr.meta_data)
+
+
+def run_trials(lr, ntotal, ntrials, seed, truth = "H0"):
+    """ Pseudo-experiments sampled from one of the hypotheses at its current parameter values.
+    Every trial fits H0 and H1, the fits are warm started from the previous trial.
+
+    Returns a dictionary with the TS and the H1 best fit value of every parameter.
+    """
+    expectation = lr.models[truth][:]
+    nb_seed(seed)
+    ds = DataSet(binning=lr.models["H1"].binning)
+    lr.data = ds
+
+    names = list(lr.models["H1"].parameters.keys())
+    ts = np.zeros(ntrials)
+    best = np.zeros((ntrials, len(names)))
+    for i in range(ntrials):
+        ds.sample(ntotal, expectation)
+        lr.fit("H0")
+        lr.fit("H1")
+        ts[i] = lr.TS
+        best[i] = [par.value for par in lr.models["H1"].parameters.values()]
+
+    result = {"ts" : ts, "seed" : np.full(ntrials, seed)}
+    for name, column in zip(names, best.T):
+        result[name] = column
+    return result
+
+
+def run_scan(lr, parname_fit, parname_fix, values):
+    """ TS_llhinterval on the data of lr for each value of parname_fix """
+    ts = np.array([lr.TS_llhinterval(value, parname_fit, parname_fix) for value in values])
+    return {parname_fix : np.asarray(values, dtype=float), "ts" : ts}
+
+
+def submit_trials(queue, lr, ntotal, ntrials, chunksize = 100, seed = None, truth = "H0"):
+    """ Splits ntrials pseudo-experiments in units of chunksize trials on a WorkQueue.
+    Each unit gets its own seed spawned from seed, so the merged trials are reproducible
+    whatever the number of workers. The test is written once for the job, units only hold
+    their seeds. Returns the id of the job."""
+    nunits = int(np.ceil(ntrials / chunksize))
+    seeds = np.random.SeedSequence(seed).generate_state(nunits)
+    lr = _fresh(lr)
+    arguments = [{"ntotal" : ntotal,
+                  "ntrials" : min(chunksize, ntrials - i * chunksize),
+                  "seed" : int(seeds[i]),
+                  "truth" : truth} for i in range(nunits)]
+    return queue.submit(run_trials, arguments, shared={"lr" : lr})
+
+
+def submit_scan(queue, lr, parname_fit, parname_fix, values, chunksize = 10):
+    """ Splits a TS_llhinterval scan over values in units of chunksize points. lr needs data loaded.
+    The test and its data are written once for the job. Returns the id of the job."""
+    values = np.asarray(values, dtype=float)
+    data = lr.data
+    lr = _fresh(lr)
+    lr.data = data
+    arguments = [{"values" : values[i:i + chunksize]} for i in range(0, len(values), chunksize)]
+    return queue.submit(run_scan, arguments, shared={"lr" : lr, "parname_fit" : parname_fit, "parname_fix" : parname_fix})
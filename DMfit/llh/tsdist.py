@@ -0,0 +1,168 @@
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import json
+import os
+from scipy import stats, optimize
+
+__all__ = ["TSDistribution"]
+
+TAILS = ["exponential", "chi2"]
+
+
+class TSDistribution():
+    """ Distribution of a test statistic built from background trials
+
+    The TS values are kept sorted, so p-values and quantiles are a binary search
+    (np.searchsorted) instead of a re-sort of the trials on every query.
+    Above a threshold the distribution can be replaced by a fitted tail to
+    extrapolate beyond the number of trials:
+
+    - "exponential": p(ts) = p(thr) * exp(-(ts - thr) / lambda)
+    - "chi2": mixture (1 - eta) * delta(0) + eta * chi2(ndof), fitted to all trials and
+      matched to the empirical p-value at the threshold
+
+    p-values are P(TS >= ts).
+    """
+
+    def __init__(self, ts, tail = None, presorted = False, **kwargs):
+        ts = np.asarray(ts, dtype=float)
+        if not presorted:
+            ts = np.sort(ts[~np.isnan(ts)])
+        if len(ts) == 0:
+            raise ValueError("TS distribution needs at least one trial")
+        self._ts = ts
+        #Tail parameters, e.g. {"kind" : "exponential", "threshold" : 10, "scale" : 1.2}
+        self._tail = tail
+        self._meta_data = kwargs.copy()
+
+    @classmethod
+    def from_trials(cls, trials, **kwargs):
+        """ Builds the distribution from trial outputs, either arrays of TS values or paths to .npy files """
+        if isinstance(trials, (str, np.ndarray)):
+            trials = [trials]
+        arrays = [np.load(t) if isinstance(t, str) else np.asarray(t, dtype=float) for t in trials]
+        return cls(np.concatenate([np.ravel(a) for a in arrays]), **kwargs)
+
+    @property
+    def meta_data(self) -> dict:
+        return self._meta_data
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._meta_data.get("name", None)
+
+    @name.setter
+    def name(self, value: str):
+        self._meta_data["name"] = str(value)
+
+    @property
+    def ts(self) -> np.ndarray:
+        """Sorted TS values (read only if the distribution was memory-mapped)"""
+        return self._ts
+
+    @property
+    def tail(self) -> Optional[dict]:
+        return self._tail
+
+    @property
+    def ntrials(self) -> int:
+        return len(self._ts)
+
+    def _empirical_pvalue(self, ts):
+        n_above = self.ntrials - np.searchsorted(self._ts, ts, side="left")
+        return n_above / self.ntrials
+
+    def fit_tail(self, kind = "exponential", threshold = None, tail_fraction = 0.01):
+        """ Fits a tail above threshold, by default the threshold leaves tail_fraction of the trials above it """
+        if kind not in TAILS:
+            raise ValueError("Tail {} is not implemented, available tails are {}".format(kind, TAILS))
+
+        if threshold is None:
+            threshold = self.quantile(tail_fraction, use_tail=False)
+        threshold = float(threshold)
+
+        tail = {"kind" : kind, "threshold" : threshold}
+        if kind == "exponential":
+            above = self._ts[np.searchsorted(self._ts, threshold, side="right"):]
+            if len(above) == 0:
+                raise ValueError("No trials above the threshold {}".format(threshold))
+            #MLE of the exponential scale
+            tail["scale"] = float(np.mean(above - threshold))
+        else:
+            positive = self._ts[self._ts > 0]
+            if len(positive) == 0:
+                raise ValueError("No trials with TS > 0 to fit a chi2 mixture")
+            tail["eta"] = len(positive) / self.ntrials
+            nll = lambda ndof: -np.sum(stats.chi2.logpdf(positive, ndof))
+            tail["ndof"] = float(optimize.minimize_scalar(nll, bounds=(0.01, 100.), method="bounded").x)
+        tail["pvalue_threshold"] = float(self._empirical_pvalue(threshold))
+
+        self._tail = tail
+        return tail
+
+    def _tail_sf(self, ts):
+        """Survival function of the tail relative to the threshold"""
+        tail = self._tail
+        if tail["kind"] == "exponential":
+            return np.exp(-(ts - tail["threshold"]) / tail["scale"])
+        else:
+            return stats.chi2.sf(ts, tail["ndof"]) / stats.chi2.sf(tail["threshold"], tail["ndof"])
+
+    def pvalue(self, ts):
+        """ p-value of observed TS value(s), O(log n) per value """
+        ts = np.asarray(ts, dtype=float)
+        p = self._empirical_pvalue(ts)
+        if self._tail is not None:
+            above = ts > self._tail["threshold"]
+            p = np.where(above, self._tail["pvalue_threshold"] * self._tail_sf(np.where(above, ts, self._tail["threshold"])), p)
+        return p[()]
+
+    def quantile(self, pvalue, use_tail = True):
+        """ TS value with a given p-value (inverse of pvalue) """
+        pvalue = np.asarray(pvalue, dtype=float)
+        index = np.clip(np.ceil((1. - pvalue) * self.ntrials).astype(int), 0, self.ntrials - 1)
+        ts = self._ts[index]
+        if use_tail and self._tail is not None:
+            tail = self._tail
+            below = pvalue < tail["pvalue_threshold"]
+            ratio = np.where(below, pvalue, tail["pvalue_threshold"]) / tail["pvalue_threshold"]
+            if tail["kind"] == "exponential":
+                ts_tail = tail["threshold"] - tail["scale"] * np.log(ratio)
+            else:
+                ts_tail = stats.chi2.isf(ratio * stats.chi2.sf(tail["threshold"], tail["ndof"]), tail["ndof"])
+            ts = np.where(below, ts_tail, ts)
+        return ts[()]
+
+    def significance(self, ts, ntrials = 1):
+        """ One-sided gaussian significance of observed TS value(s), corrected for ntrials independent tests """
+        p = np.asarray(self.pvalue(ts), dtype=float)
+        if ntrials > 1:
+            #1 - (1 - p)^n without losing precision for small p
+            p = -np.expm1(ntrials * np.log1p(-p))
+        return stats.norm.isf(p)
+
+    def save(self, path):
+        """ Saves to path.npy (sorted TS) and path.json (tail and meta data) """
+        path = os.path.splitext(path)[0]
+        np.save(path + ".npy", self._ts)
+        with open(path + ".json", "w") as f:
+            json.dump({"tail" : self._tail, "meta_data" : self._meta_data}, f)
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        """ Loads a saved distribution. With mmap the sorted TS array is memory-mapped read only,
+        so many distributions can be opened in the same process without reading them into memory."""
+        path = os.path.splitext(path)[0]
+        ts = np.load(path + ".npy", mmap_mode="r" if mmap else None)
+        with open(path + ".json") as f:
+            info = json.load(f)
+        return cls(ts, tail=info["tail"], presorted=True, **info["meta_data"])
+
+    def __str__(self):
+        lines = []
+        lines.append("TS distribution {}".format(self.name))
+        lines.append("Number of trials: {}".format(self.ntrials))
+        lines.append("Median TS: {:.3f}".format(self.quantile(0.5, use_tail=False)))
+        if self._tail is not None:
+            lines.append("Tail: {}".format(self._tail))
+        return "\n".join(lines)
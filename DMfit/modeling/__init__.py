@@ -1,3 +1,7 @@
-from .pdf import PdfBase
+from .pdf import PdfBase, PdfView
 from .parameter import Parameter
-from .model import Model
\ No newline at end of file
+from .model import Model
+from .binning import Binning
+from .morphing import MorphingPdf
+from .prior import Prior, UniformPrior, LogUniformPrior, GaussianPrior
+from .merging import BinMerging
\ No newline at end of file
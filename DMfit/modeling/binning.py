@@ -0,0 +1,148 @@
+import abc
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import copy
+
+__all__ = ["Binning"]
+
+
+class Binning():
+    """ N-D rectangular binning of a histogram
+
+    Pdfs and datasets store their bins flattened (C order), the binning keeps
+    the shape and the edges so they can be reshaped back and so regions of
+    interest can be selected by axis name, e.g.
+
+    binning = Binning([E_edges, psi_edges], names=["E_reco", "psi_reco"])
+    index = binning.index(psi_reco=(None, 0.5), E_reco=(100, 1e4))
+    """
+
+    def __init__(self, edges, names = None):
+        edges = [np.asarray(e, dtype=float) for e in edges]
+        for e in edges:
+            if e.ndim != 1 or len(e) < 2:
+                raise ValueError("Edges of each axis need to be a 1-D array with at least two values")
+            if np.any(np.diff(e) <= 0):
+                raise ValueError("Edges need to be strictly increasing")
+        self._edges = edges
+
+        if names is None:
+            names = ["x{}".format(i) for i in range(len(edges))]
+        if len(names) != len(edges):
+            raise ValueError("Number of axis names {} is not the number of axes {}".format(len(names), len(edges)))
+        self._names = [str(n) for n in names]
+
+    @classmethod
+    def from_shape(cls, shape, names = None):
+        """Binning with bin numbers as edges, for histograms without edges"""
+        return cls([np.arange(n + 1) for n in shape], names=names)
+
+    @property
+    def edges(self) -> list:
+        return self._edges
+
+    @property
+    def names(self) -> list:
+        return self._names
+
+    @property
+    def centers(self) -> list:
+        return [0.5 * (e[1:] + e[:-1]) for e in self._edges]
+
+    @property
+    def shape(self) -> tuple:
+        return tuple(len(e) - 1 for e in self._edges)
+
+    @property
+    def ndim(self) -> int:
+        return len(self._edges)
+
+    @property
+    def nbins(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def volumes(self) -> np.ndarray:
+        """Flat volume of each bin, product of the bin widths along the axes"""
+        volumes = np.ones(1)
+        for e in self._edges:
+            volumes = np.ravel(np.multiply.outer(volumes, np.diff(e)))
+        return volumes
+
+    def lookup(self, x: np.ndarray) -> np.ndarray:
+        """ Flat bin index of points x (n, ndim), -1 for points outside of the binning.
+        Bins are closed on the lower edge, the last bin also on the upper edge."""
+        x = np.reshape(x, (len(x), self.ndim))
+        flat = np.zeros(len(x), dtype=np.int64)
+        inside = np.ones(len(x), dtype=bool)
+        for axis, e in enumerate(self._edges):
+            i = np.searchsorted(e, x[:, axis], side="right") - 1
+            i[x[:, axis] == e[-1]] = len(e) - 2
+            inside &= (i >= 0) & (i < len(e) - 1)
+            flat = flat * (len(e) - 1) + i
+        flat[~inside] = -1
+        return flat
+
+    def interpolation_lookup(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ For multilinear interpolation between bin centers: per axis index of the center
+        below each point of x (n, ndim) and fractional distance to the next center.
+        Points beyond the outer centers get the value of the outer bin (fraction clipped)."""
+        x = np.reshape(x, (len(x), self.ndim))
+        index = np.zeros(x.shape, dtype=np.int32)
+        fraction = np.zeros(x.shape, dtype=np.float32)
+        for axis, c in enumerate(self.centers):
+            if len(c) == 1:
+                continue
+            i = np.clip(np.searchsorted(c, x[:, axis], side="right") - 1, 0, len(c) - 2)
+            index[:, axis] = i
+            fraction[:, axis] = np.clip((x[:, axis] - c[i]) / (c[i + 1] - c[i]), 0., 1.)
+        return index, fraction
+
+    def axis(self, name) -> int:
+        if isinstance(name, int):
+            return name
+        if name not in self._names:
+            raise ValueError("Axis {} not in the binning, available axes are {}".format(name, self._names))
+        return self._names.index(name)
+
+    def reshape(self, values: np.ndarray) -> np.ndarray:
+        """Flat per-bin values to the N-D shape of the binning"""
+        return np.reshape(values, self.shape)
+
+    def mask(self, cuts = None, **kwargs) -> np.ndarray:
+        """ N-D boolean mask of the bins whose center passes the cuts.
+        Cuts are given per axis name as (low, high), None for an open side."""
+        cuts = dict(cuts or {}, **kwargs)
+        mask = np.ones(self.shape, dtype=bool)
+        for name, (low, high) in cuts.items():
+            axis = self.axis(name)
+            centers = self.centers[axis]
+            passed = np.ones(len(centers), dtype=bool)
+            if low is not None:
+                passed &= centers >= low
+            if high is not None:
+                passed &= centers < high
+            shape = [1] * self.ndim
+            shape[axis] = len(centers)
+            mask &= passed.reshape(shape)
+        return mask
+
+    def index(self, cuts = None, **kwargs) -> np.ndarray:
+        """Flat index of the bins passing the cuts (see mask)"""
+        return np.flatnonzero(self.mask(cuts, **kwargs))
+
+    def copy(self):
+        """A deep copy"""
+        return copy.deepcopy(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, Binning):
+            return False
+        return self.shape == other.shape and all(np.array_equal(a, b) for a, b in zip(self._edges, other._edges))
+
+    def __str__(self):
+        lines = []
+        lines.append(" Binning: shape {}".format(self.shape))
+        for name, e in zip(self._names, self._edges):
+            lines.append(" - {}: {} bins in ({:.3g}, {:.3g})".format(name, len(e) - 1, e[0], e[-1]))
+        return "\n".join(lines)
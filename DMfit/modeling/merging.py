@@ -0,0 +1,178 @@
+import abc
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import collections
+import copy
+
+from .binning import Binning
+from .pdf import PdfBase, PdfView
+from .morphing import MorphingPdf
+
+__all__ = ["BinMerging"]
+
+
+class BinMerging():
+    """ Merging of the bins of a histogram into groups, stored as an index: group[i] is the
+    merged bin of the fine bin i. Applying it is a bincount, so the same merging can be applied
+    to every pdf of a model and to the datasets (data, pseudo-experiments), and saved to disk
+    to be reused by trials and scans.
+
+    Merged bins are not rectangular, pdfs and datasets get a 1-D binning of the merged bins.
+    """
+
+    def __init__(self, group, **kwargs):
+        group = np.asarray(group)
+        if group.ndim != 1 or not np.issubdtype(group.dtype, np.integer):
+            raise ValueError("Group needs to be a 1-D integer array, the merged bin of each bin")
+        self._group = group
+        self._ngroups = int(group.max()) + 1 if len(group) > 0 else 0
+        self._meta_data = kwargs.copy()
+
+    @classmethod
+    def build(cls, model, ntotal, signal, min_background = 1., max_spread = 0.5, composition_tolerance = 0.1):
+        """ Merges the bins of a model with little expected background (the model is linear in its pdfs)
+
+        - ntotal: number of events the expectation is scaled to
+        - signal: name (or list of names) of the signal pdfs, the other pdfs are the background,
+          weighted by the current values of the parameters
+        - min_background: bins with less expected background counts are merged, until the merged
+          bin reaches min_background. Other bins are kept as they are.
+        - max_spread: maximum spread of log(signal / background) of the shapes in a merged bin,
+          bins with the same ratio carry the same information on the signal
+        - composition_tolerance: bins are only merged if the fraction of each background pdf in
+          the background is in the same interval of this width, so nuisance parameters keep their shape
+
+        Bins with neither signal nor background are merged into one bin.
+        """
+        signal = [signal] if isinstance(signal, str) else list(signal)
+        for name in signal:
+            if name not in model.pdfs.keys():
+                raise ValueError("Pdf {} is not in the model".format(name))
+        weights = model.template_weights()
+        background_names = [name for name in model.pdfs.keys() if name not in signal]
+
+        components = np.array([ntotal * weights[name].ravel()[0] * model.pdfs[name][:] for name in background_names])
+        background = np.sum(components, axis=0)
+        signal_shape = np.sum([model.pdfs[name][:] for name in signal], axis=0)
+        background_shape = background / np.sum(background)
+        nbins = len(background)
+
+        empty = (background <= 0) & (signal_shape <= 0)
+        candidates = np.flatnonzero((background < min_background) & ~empty)
+        tiny = np.finfo(float).tiny
+        log_ratio = np.log((signal_shape + tiny) / (background_shape + tiny))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fractions = np.where(background > 0, components / background, 0.)
+        composition = np.floor(fractions / composition_tolerance).astype(np.int64).T
+
+        #Raw group labels: kept bins are their own group, merged groups get labels above nbins
+        raw = np.arange(nbins)
+        raw[empty] = nbins
+        label = nbins + 1
+        classes = collections.defaultdict(list)
+        for i in candidates:
+            classes[tuple(composition[i])].append(i)
+        for members in classes.values():
+            members = np.array(members)[np.argsort(log_ratio[members], kind="stable")]
+            start, total = None, 0.
+            for i in members:
+                if start is not None and (total >= min_background or log_ratio[i] - start > max_spread):
+                    label += 1
+                    start, total = None, 0.
+                if start is None:
+                    start = log_ratio[i]
+                raw[i] = label
+                total += background[i]
+            label += 1
+
+        group = np.unique(raw, return_inverse=True)[1].astype(np.int64)
+        return cls(group, min_background=min_background, max_spread=max_spread, composition_tolerance=composition_tolerance,
+                   ntotal=ntotal, signal=signal)
+
+    @property
+    def meta_data(self) -> dict:
+        return self._meta_data
+
+    @property
+    def group(self) -> np.ndarray:
+        return self._group
+
+    @property
+    def nbins(self) -> int:
+        """Number of bins before merging"""
+        return len(self._group)
+
+    @property
+    def ngroups(self) -> int:
+        """Number of merged bins"""
+        return self._ngroups
+
+    @property
+    def binning(self) -> Binning:
+        return Binning.from_shape((self._ngroups,), names=["merged"])
+
+    def apply(self, values) -> np.ndarray:
+        """ Sums per-bin values (counts, frequencies, errors2) over the merged bins, along the last axis """
+        values = np.asarray(values, dtype=float)
+        if values.shape[-1] != self.nbins:
+            raise ValueError("Values have {} bins, the merging is defined on {} bins".format(values.shape[-1], self.nbins))
+        if values.ndim == 1:
+            return np.bincount(self._group, weights=values, minlength=self._ngroups)
+        flat = values.reshape(-1, self.nbins)
+        merged = np.zeros((len(flat), self._ngroups))
+        for row, v in zip(merged, flat):
+            row[:] = np.bincount(self._group, weights=v, minlength=self._ngroups)
+        return merged.reshape(values.shape[:-1] + (self._ngroups,))
+
+    def pdf(self, pdf):
+        """ The pdf on the merged bins """
+        if isinstance(pdf, PdfView):
+            raise ValueError("Cannot merge a view of a pdf, merge the full model and select a region afterwards")
+        try:
+            errors2 = pdf._errors2 if isinstance(pdf, MorphingPdf) else pdf.errors2
+        except AttributeError:
+            errors2 = None
+        if isinstance(pdf, MorphingPdf):
+            merged = MorphingPdf(pdf.masses, self.apply(pdf.references), pdf.mass,
+                                 errors2=None if errors2 is None else self.apply(errors2), binning=self.binning, **pdf.meta_data)
+            return merged
+        if pdf.dynamic:
+            raise ValueError("Merging of {} is not implemented".format(type(pdf).__name__))
+        merged = copy.copy(pdf)
+        merged._binning = self.binning
+        merged.frequencies = self.apply(pdf.frequencies)
+        if errors2 is not None:
+            merged.errors2 = self.apply(errors2)
+        return merged
+
+    def model(self, model):
+        """ The model on the merged bins. As Model.region the parameters are shared with model. """
+        m = copy.copy(model)
+        m._pdfs = collections.OrderedDict([(name, self.pdf(pdf)) for name, pdf in model.pdfs.items()])
+        return m
+
+    def dataset(self, ds):
+        """ A DataSet with the values (and errors2) merged, event lists are not kept """
+        merged = copy.copy(ds)
+        merged._events = None
+        merged._rois = {}
+        merged.binning = self.binning
+        merged.values = self.apply(ds.values)
+        try:
+            merged.errors2 = self.apply(ds.errors2)
+        except AttributeError:
+            pass
+        return merged
+
+    def save(self, path):
+        settings = {key : self._meta_data[key] for key in ("min_background", "max_spread", "composition_tolerance", "ntotal") if key in self._meta_data}
+        np.savez(path, group=self._group, signal=np.array(self._meta_data.get("signal", []), dtype=str), **settings)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            settings = {key : float(f[key]) for key in ("min_background", "max_spread", "composition_tolerance", "ntotal") if key in f.files}
+            return cls(f["group"], signal=[str(s) for s in f["signal"]], **settings)
+
+    def __str__(self):
+        return "BinMerging: {} bins merged into {}".format(self.nbins, self.ngroups)
@@ -4,6 +4,7 @@ import numpy as np
 import collections
 import itertools 
 import copy
+import hashlib
 
 
 __all__ = ["Model"]
@@ -26,6 +27,13 @@ class Model():
         if parameters is not None:    
             for param in parameters:
                 self._add_parameter(param.copy())
+        
+        #Pdfs depending on parameters (e.g. MorphingPdf) share the parameter objects of the model
+        for pdf in self._pdfs.values():
+            for name, param in getattr(pdf, "parameters", {}).items():
+                if name not in self._parameters.keys():
+                    self._parameters[name] = param
+                pdf.bind(self._parameters[name])
 
         
     def _add_parameter(self, param):
@@ -95,10 +103,61 @@ class Model():
     def npars(self) -> int:
         return len(self._parameters.keys())
     
+    @property
+    def binning(self):
+        """Binning of the pdfs of the model (taken from the first pdf)"""
+        if len(self._pdfs.keys()) == 0:
+            raise AttributeError("Model is empty")
+        return next(iter(self._pdfs.values())).binning
+    
+    def region(self, index):
+        """ Model evaluated on a subset of bins (flat index), with every pdf renormalized on them.
+        The pdfs are replaced by views, templates are not copied, and the parameters are shared
+        with this model, so fitting the region updates the parameters of this model."""
+        m = copy.copy(self)
+        m._pdfs = collections.OrderedDict([(name, PdfView(pdf, index)) for name, pdf in self._pdfs.items()])
+        return m
+    
     def copy(self):
         """A deep copy"""
         return copy.deepcopy(self)
 
+    def clone(self):
+        """ Copy with its own parameters that shares the templates with this model (pdfs are
+        copied shallow and bound to the new parameters). Clones can be fitted at the same time
+        in threads without touching each other, at no memory cost. """
+        m = copy.copy(self)
+        m._meta_data = self._meta_data.copy()
+        m._parameters = collections.OrderedDict([(name, par.copy()) for name, par in self._parameters.items()])
+        m._pdfs = collections.OrderedDict()
+        for name, pdf in self._pdfs.items():
+            pdf = copy.copy(pdf)
+            if isinstance(pdf, PdfView):
+                #Binding a view binds its parent
+                pdf._parent = copy.copy(pdf.parent)
+            for parname in getattr(pdf, "parameters", {}).keys():
+                pdf.bind(m._parameters[parname])
+            m._pdfs[name] = pdf
+        return m
+
+    def structure_hash(self) -> str:
+        """Hash of the expression and of the parameter table (names, limits, scale, fixed).
+        Parameter values are not included, so fitting does not change the hash."""
+        h = hashlib.sha1()
+        h.update(str(self.expression).encode())
+        for name, par in self._parameters.items():
+            h.update("{}:{}:{}:{}".format(name, tuple(par.limits), par.scale, par.fixed).encode())
+        return h.hexdigest()
+
+    def template_hash(self) -> str:
+        """Hash of the frequencies of every pdf in the model"""
+        h = hashlib.sha1()
+        for name, pdf in self._pdfs.items():
+            h.update(name.encode())
+            #Morphing pdfs are hashed by their reference templates, not the current frequencies
+            h.update(np.ascontiguousarray(getattr(pdf, "references", pdf.frequencies), dtype=float).tobytes())
+        return h.hexdigest()
+
         
     def __len__(self) -> int:
         #To do check if the _pdfs is initiated
@@ -125,6 +184,100 @@ class Model():
         #Only return positive values from a Model
         return np.maximum(0, eval(expression, {}, variables))
     
+    def evaluate_batch(self, factors: np.ndarray, index = slice(None)) -> np.ndarray:
+        """ Model for many parameter vectors at once, without touching the parameters
+
+        factors: array (n_points, npars) in factor space (as the minimizer sees them),
+                 columns ordered as self.parameters
+        Returns an array (n_points, nbins).
+
+        The expression is evaluated once with every parameter replaced by a column of
+        values, so each term broadcasts to a (n_points, nbins) block.
+        """
+        factors = np.atleast_2d(np.asarray(factors, dtype=float))
+        if factors.shape[1] != self.npars:
+            raise ValueError("The number of parameters {} passed is not the same as the number of parameters in the Model {}".format(factors.shape[1], self.npars))
+        columns = self._columns(factors)
+        
+        variables = {"index" : index, "self": _BatchNamespace(self, columns)}
+        values = np.maximum(0, eval(self.expression, {}, variables))
+        return np.broadcast_to(values, (len(factors), np.shape(values)[-1]))
+    
+    def gradient_batch(self, factors: np.ndarray, index = slice(None)) -> Tuple[np.ndarray, np.ndarray]:
+        """ Model and its derivatives with respect to the factors of the parameters, for many
+        parameter vectors at once (forward-mode automatic differentiation of the expression)
+
+        factors: array (n_points, npars) in factor space, as in evaluate_batch
+        Returns the model (n_points, nbins) and the gradient (n_points, npars, nbins).
+        Pdfs depending on parameters need a derivative_batch method (e.g. MorphingPdf).
+        """
+        return self._differentiate(factors, index, False)
+    
+    def hessian_batch(self, factors: np.ndarray, index = slice(None)) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ As gradient_batch, with the second derivatives (n_points, npars, npars, nbins) as well.
+        Pdfs depending on parameters need a second_derivative_batch method."""
+        return self._differentiate(factors, index, True)
+    
+    def _differentiate(self, factors, index, second):
+        factors = np.atleast_2d(np.asarray(factors, dtype=float))
+        if factors.shape[1] != self.npars:
+            raise ValueError("The number of parameters {} passed is not the same as the number of parameters in the Model {}".format(factors.shape[1], self.npars))
+        columns = self._columns(factors)
+        
+        variables = {"index" : index, "self": _DualNamespace(self, columns, second)}
+        result = _Dual.lift(eval(self.expression, {}, variables))
+        shape = (len(factors), np.shape(result.value)[-1])
+        values = np.broadcast_to(result.value, shape)
+        #Only positive values from a Model, the clipped bins do not depend on the parameters
+        positive = values > 0
+        gradient = np.moveaxis(np.broadcast_to(result.grad, (self.npars,) + shape), 0, 1)
+        gradient = np.where(positive[:, None, :], gradient, 0.)
+        if not second:
+            return np.maximum(0, values), gradient
+        hessian = np.moveaxis(np.broadcast_to(0. if result.hess is None else result.hess, (self.npars, self.npars) + shape), 2, 0)
+        hessian = np.where(positive[:, None, None, :], hessian, 0.)
+        return np.maximum(0, values), gradient, hessian
+    
+    def _columns(self, factors = None):
+        """Parameter values as columns (n_points, 1), from factors or from the current values"""
+        if factors is None:
+            return collections.OrderedDict([(name, np.array([[par.value]])) for name, par in self._parameters.items()])
+        factors = np.atleast_2d(np.asarray(factors, dtype=float))
+        return collections.OrderedDict([(name, factors[:, [i]] * par.scale) for i, (name, par) in enumerate(self._parameters.items())])
+    
+    def template_weights(self, factors = None) -> collections.OrderedDict:
+        """ Weight of each pdf, for models linear in the pdfs: model = sum_t w_t * pdf_t + c
+        
+        The expression is evaluated with every pdf set to 0 and then with one pdf at a time set to 1.
+        With factors (n_points, npars) the weights are columns (n_points, 1), otherwise they are
+        computed at the current parameter values (arrays of shape (1, 1)).
+        """
+        columns = self._columns(factors)
+        zeros = {name : 0. for name in self._pdfs.keys()}
+        base = eval(self.expression, {}, {"index" : 0, "self" : _BatchNamespace(self, columns, zeros)})
+        weights = collections.OrderedDict()
+        for name in self._pdfs.keys():
+            unit = dict(zeros, **{name : 1.})
+            weights[name] = eval(self.expression, {}, {"index" : 0, "self" : _BatchNamespace(self, columns, unit)}) - base
+        return weights
+    
+    def variance(self, index = slice(None), factors = None) -> np.ndarray:
+        """ MC variance of the model per bin, sum_t w_t^2 * errors2_t, propagated from the errors2 of the pdfs
+        (pdfs without errors2 do not contribute). Shape (nbins,) at the current parameter values,
+        (n_points, nbins) with factors."""
+        columns = self._columns(factors)
+        weights = self.template_weights(factors)
+        npoints = len(next(iter(columns.values())))
+        nbins = len(np.arange(self.__len__())[index])
+        variance = np.zeros((npoints, nbins))
+        for name, pdf in self._pdfs.items():
+            try:
+                errors2 = pdf.errors2_batch(columns, index)
+            except AttributeError:
+                continue
+            variance += weights[name]**2 * errors2
+        return variance if factors is not None else variance[0]
+    
     def __mul__(self, other):
         m = None
         if isinstance(other, Model):
@@ -261,5 +414,153 @@ class Model():
         return "\n".join(lines)
     
     
-from .pdf import PdfBase
+from .pdf import PdfBase, PdfView
 from .parameter import Parameter
+
+
+class _BatchValue():
+    """Stands for a Parameter in a batched evaluation, value is a column (n_points, 1)"""
+    def __init__(self, value):
+        self.value = value
+
+
+class _BatchPdf():
+    """Stands for a pdf in a batched evaluation"""
+    def __init__(self, pdf, columns):
+        self._pdf = pdf
+        self._columns = columns
+        
+    def __getitem__(self, index):
+        return self._pdf.evaluate_batch(self._columns, index)
+
+
+class _BatchNamespace():
+    """Replaces the model as 'self' in the expression of a batched evaluation,
+    pdfs can be replaced by constants (name -> value) to get the weights of the pdfs"""
+    def __init__(self, model, columns, constants = None):
+        self._parameters = {name : _BatchValue(column) for name, column in columns.items()}
+        if constants is None:
+            self._pdfs = {name : _BatchPdf(pdf, columns) for name, pdf in model.pdfs.items()}
+        else:
+            self._pdfs = {name : [value] for name, value in constants.items()}
+
+
+
+class _Dual():
+    """ A value with its derivatives with respect to the parameters, for the forward-mode
+    differentiation of the expression: grad has a leading axis of size npars and hess two
+    (hyper-dual numbers), 0. for constants. hess is None when only gradients are propagated."""
+    __array_ufunc__ = None
+
+    def __init__(self, value, grad = 0., hess = None):
+        self.value = value
+        self.grad = grad
+        self.hess = hess
+
+    @staticmethod
+    def lift(other):
+        return other if isinstance(other, _Dual) else _Dual(np.asarray(other, dtype=float))
+
+    @staticmethod
+    def _outer(a, b):
+        if np.ndim(a) == 0 or np.ndim(b) == 0:
+            return 0.
+        return a[:, None] * b[None, :]
+
+    @staticmethod
+    def _hess(*terms):
+        #None (first order only) unless one of the operands carries second derivatives
+        return None if all(t is None for t in terms) else sum(0. if t is None else t for t in terms)
+
+    def __add__(self, other):
+        other = _Dual.lift(other)
+        return _Dual(self.value + other.value, self.grad + other.grad, _Dual._hess(self.hess, other.hess))
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return _Dual(-self.value, -self.grad, None if self.hess is None else -self.hess)
+
+    def __sub__(self, other):
+        return self + (-_Dual.lift(other))
+
+    def __rsub__(self, other):
+        return _Dual.lift(other) - self
+
+    def __mul__(self, other):
+        other = _Dual.lift(other)
+        hess = None
+        if self.hess is not None or other.hess is not None:
+            cross = _Dual._outer(self.grad, other.grad)
+            hess = (0. if self.hess is None else self.hess * other.value) + (0. if other.hess is None else self.value * other.hess) \
+                + cross + (0. if np.ndim(cross) == 0 else np.swapaxes(cross, 0, 1))
+        return _Dual(self.value * other.value, self.grad * other.value + self.value * other.grad, hess)
+
+    __rmul__ = __mul__
+
+    def _reciprocal(self):
+        value = 1. / self.value
+        hess = None
+        if self.hess is not None:
+            hess = 2. * _Dual._outer(self.grad, self.grad) * value**3 - self.hess * value**2
+        return _Dual(value, -self.grad * value**2, hess)
+
+    def __truediv__(self, other):
+        return self * _Dual.lift(other)._reciprocal()
+
+    def __rtruediv__(self, other):
+        return _Dual.lift(other) * self._reciprocal()
+
+    def __pow__(self, exponent):
+        if isinstance(exponent, _Dual):
+            raise TypeError("Parameters in exponents are not supported")
+        first = exponent * self.value**(exponent - 1)
+        hess = None
+        if self.hess is not None:
+            hess = first * self.hess + exponent * (exponent - 1) * self.value**(exponent - 2) * _Dual._outer(self.grad, self.grad)
+        return _Dual(self.value**exponent, first * self.grad, hess)
+
+
+class _DualPdf():
+    """Stands for a pdf in the differentiation, derivatives only for pdfs depending on parameters"""
+    def __init__(self, pdf, columns, positions, scales, second):
+        self._pdf = pdf
+        self._columns = columns
+        self._positions = positions
+        self._scales = scales
+        self._second = second
+
+    def __getitem__(self, index):
+        value = self._pdf.evaluate_batch(self._columns, index)
+        parameters = list(getattr(self._pdf, "parameters", {}).keys())
+        npars = len(self._positions)
+        if len(parameters) == 0:
+            return _Dual(value, 0., 0. if self._second else None)
+        grad = np.zeros((npars,) + np.shape(value))
+        for name in parameters:
+            i = self._positions[name]
+            grad[i] = self._pdf.derivative_batch(self._columns, name, index) * self._scales[i]
+        hess = None
+        if self._second:
+            hess = np.zeros((npars, npars) + np.shape(value))
+            for a in parameters:
+                for b in parameters:
+                    i, j = self._positions[a], self._positions[b]
+                    hess[i, j] = self._pdf.second_derivative_batch(self._columns, a, b, index) * self._scales[i] * self._scales[j]
+        return _Dual(value, grad, hess)
+
+
+class _DualNamespace():
+    """Replaces the model as 'self' in the expression of a differentiation, parameters are
+    columns (n_points, 1) seeded with their derivative with respect to their own factor (the scale)"""
+    def __init__(self, model, columns, second = False):
+        npars = len(columns)
+        scales = np.array([par.scale for par in model.parameters.values()], dtype=float)
+        positions = {name : i for i, name in enumerate(columns.keys())}
+        self._parameters = {}
+        for i, (name, column) in enumerate(columns.items()):
+            grad = np.zeros((npars,) + column.shape)
+            grad[i] = scales[i]
+            hess = np.zeros((npars, npars) + column.shape) if second else None
+            self._parameters[name] = _BatchValue(_Dual(column, grad, hess))
+        self._pdfs = {name : _DualPdf(pdf, columns, positions, scales, second) for name, pdf in model.pdfs.items()}
@@ -0,0 +1,165 @@
+import abc
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import collections
+import copy
+
+from .pdf import PdfBase
+from .parameter import Parameter
+
+__all__ = ["MorphingPdf"]
+
+
+class MorphingPdf(PdfBase):
+    """ Pdf interpolated between reference templates as a function of a mass parameter
+
+    Templates are interpolated linearly in log(mass) between the two neighbouring
+    reference masses. The basis (reference templates and their slopes in log(mass))
+    is computed once, so evaluation at any mass is a single blend
+
+    f(m) = T_k + (log m - log m_k) * S_k,    S_k = (T_k+1 - T_k) / (log m_k+1 - log m_k)
+
+    and memory scales with the number of reference templates, not with the number of
+    masses evaluated. A blend of normalized templates is normalized, so no
+    renormalization is needed.
+
+    The mass Parameter is added to any Model built with this pdf, so it can be fitted
+    or scanned like any other parameter. Its limits need to be within the reference masses.
+    """
+
+    #Frequencies change with the value of a parameter
+    dynamic = True
+
+    def __init__(self, masses, templates, mass, errors2 = None, binning = None, **kwargs):
+        masses = np.asarray(masses, dtype=float)
+        templates = np.asarray(templates, dtype=float)
+        templates = templates.reshape(len(templates), -1)
+        if len(masses) < 2:
+            raise ValueError("Morphing needs at least two reference templates")
+        if len(masses) != len(templates):
+            raise ValueError("Number of masses {} is not the number of templates {}".format(len(masses), len(templates)))
+        if np.any(templates < 0):
+            raise ValueError("Cannot have negative values in the pdf.")
+        if not np.allclose(np.sum(templates, axis=1), 1.):
+            raise ValueError("Reference templates are not normalized!")
+
+        order = np.argsort(masses)
+        self._masses = masses[order]
+        self._references = templates[order]
+        self._log_masses = np.log(self._masses)
+        self._slopes = np.diff(self._references, axis=0) / np.diff(self._log_masses)[:, None]
+
+        self._errors2 = None
+        if errors2 is not None:
+            errors2 = np.asarray(errors2, dtype=float).reshape(len(masses), -1)[order]
+            self._errors2 = errors2
+            self._errors2_slopes = np.diff(errors2, axis=0) / np.diff(self._log_masses)[:, None]
+
+        self._binning = binning
+        self.mass = mass
+        self._meta_data = kwargs.copy()
+
+    @classmethod
+    def from_pdfs(cls, masses, pdfs, mass, **kwargs):
+        """Morphing between a list of PdfBase, one per reference mass"""
+        templates = np.array([pdf.frequencies for pdf in pdfs])
+        try:
+            errors2 = np.array([pdf.errors2 for pdf in pdfs])
+        except AttributeError:
+            errors2 = None
+        #Pdfs without binning (e.g. pickled before binnings existed) give a morphing without N-D shape
+        return cls(masses, templates, mass, errors2=errors2, binning=getattr(pdfs[0], "binning", None), **kwargs)
+
+    @property
+    def mass(self) -> Parameter:
+        return self._mass
+
+    @mass.setter
+    def mass(self, par: Parameter):
+        if not isinstance(par, Parameter):
+            raise TypeError("Mass needs to be a Parameter")
+        if par.lower_limit < self._masses[0] or par.upper_limit > self._masses[-1]:
+            raise ValueError("Limits of {} ({}, {}) are outside the reference masses ({}, {})".format(
+                par.name, par.lower_limit, par.upper_limit, self._masses[0], self._masses[-1]))
+        self._mass = par
+
+    @property
+    def parameters(self) -> collections.OrderedDict:
+        """Parameters the frequencies depend on"""
+        return collections.OrderedDict([(self._mass.name, self._mass)])
+
+    def bind(self, par: Parameter):
+        """Replaces the mass parameter, used by Model to share its own copy of the parameter"""
+        self.mass = par
+
+    @property
+    def masses(self) -> np.ndarray:
+        return self._masses
+
+    @property
+    def references(self) -> np.ndarray:
+        """Reference templates, shape (n_masses, nbins)"""
+        return self._references
+
+    def _segment(self, mass):
+        """Index of the reference template below mass and distance to it in log(mass)"""
+        log_mass = np.log(np.clip(mass, self._masses[0], self._masses[-1]))
+        k = np.clip(np.searchsorted(self._log_masses, log_mass, side="right") - 1, 0, len(self._masses) - 2)
+        return k, log_mass - self._log_masses[k]
+
+    def evaluate(self, mass, index = slice(None)):
+        """ Frequencies at a mass (a float) or at an array of masses, shape (n_masses, nbins).
+        index selects bins as in __getitem__."""
+        k, dlog = self._segment(mass)
+        if np.ndim(mass) == 0:
+            return self._references[k][index] + dlog * self._slopes[k][index]
+        return self._references[k][:, index] + dlog[:, None] * self._slopes[k][:, index]
+
+    def __getitem__(self, index):
+        return self.evaluate(self._mass.value, index)
+
+    def evaluate_batch(self, columns, index = slice(None)):
+        return self.evaluate(np.ravel(columns[self._mass.name]), index)
+
+    def derivative_batch(self, columns, name, index = slice(None)):
+        """Derivative of the frequencies with respect to the mass, S_k / m, shape (n_masses, nbins)"""
+        mass = np.ravel(columns[name])
+        k, dlog = self._segment(mass)
+        return self._slopes[k][:, index] / mass[:, None]
+
+    def second_derivative_batch(self, columns, name, other, index = slice(None)):
+        """Second derivative of the frequencies with respect to the mass, -S_k / m^2"""
+        mass = np.ravel(columns[name])
+        k, dlog = self._segment(mass)
+        return -self._slopes[k][:, index] / mass[:, None]**2
+
+    @property
+    def frequencies(self):
+        return self[:]
+
+    def evaluate_errors2(self, mass, index = slice(None)):
+        """errors2 at a mass or an array of masses, interpolated as the frequencies"""
+        if self._errors2 is None:
+            raise AttributeError("Errors2 not set yet!")
+        k, dlog = self._segment(mass)
+        if np.ndim(mass) == 0:
+            return self._errors2[k][index] + dlog * self._errors2_slopes[k][index]
+        return self._errors2[k][:, index] + dlog[:, None] * self._errors2_slopes[k][:, index]
+
+    @property
+    def errors2(self):
+        return self.evaluate_errors2(self._mass.value)
+
+    def errors2_batch(self, columns, index = slice(None)):
+        return self.evaluate_errors2(np.ravel(columns[self._mass.name]), index)
+
+    @property
+    def nbins(self) -> int:
+        return self._references.shape[1]
+
+    def __str__(self):
+        lines = []
+        lines.append(" MorphingPdf: {}".format(self.name))
+        lines.append(" Reference masses: {}".format(self._masses))
+        lines.append(" Mass parameter: {} = {}".format(self._mass.name, self._mass.value))
+        return "\n".join(lines)
@@ -4,12 +4,12 @@ import numpy as np
 import collections
 import itertools
 import copy
+from .prior import Prior
 
 __all__ = ["Parameter"]
 
 class Parameter():
     """ Parameter class 
-    To do: Add priors
     To do: Add scale
     
     This idea is taking from Gammapy and is implented as such
@@ -21,7 +21,7 @@ class Parameter():
 
     """
     
-    def __init__(self, name, value, limits, scale = 1, fixed = False, is_nuisance = False, **kwargs):
+    def __init__(self, name, value, limits, scale = 1, fixed = False, is_nuisance = False, prior = None, **kwargs):
         
         self.fixed = fixed
         self._meta_data = kwargs.copy()
@@ -42,6 +42,7 @@ class Parameter():
     
         self.name = name
         self.is_nuisance = is_nuisance
+        self.prior = prior
         
     @property    
     def meta_data(self) -> dict:
@@ -117,6 +118,24 @@ class Parameter():
             raise TypeError(f"Invalid type: {value}, {type(value)}")
         self._is_nuisance = value
 
+    @property
+    def prior(self) -> Optional[Prior]:
+        """Prior in value space, None is flat within the limits"""
+        return getattr(self, "_prior", None)
+    
+    @prior.setter
+    def prior(self, value: Optional[Prior]):
+        if value is not None and not isinstance(value, Prior):
+            raise TypeError(f"Invalid type: {value}, {type(value)}")
+        self._prior = value
+    
+    def log_prior(self, value) -> np.ndarray:
+        """Log prior of value(s), -inf outside the limits"""
+        value = np.asarray(value, dtype=float)
+        inside = (value >= self.lower_limit) & (value <= self.upper_limit)
+        logp = np.zeros(value.shape) if self.prior is None else self.prior.logpdf(value)
+        return np.where(inside, logp, -np.inf)
+
     @property
     def limits(self) -> np.ndarray:
         return self._factor_limits * self._scale
@@ -232,6 +251,8 @@ class Parameter():
         lines.append(" Limits: ({:.1f}, {:.1f})".format(self.limits[0], self.limits[1]))
         lines.append(" Fixed: {}".format(self.fixed))
         lines.append(" Is nuisance? {}".format(self.is_nuisance))
+        if self.prior is not None:
+            lines.append(" Prior: {}".format(self.prior))
         return ",".join(lines)
 
     
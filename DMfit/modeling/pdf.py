@@ -4,8 +4,9 @@ import numpy as np
 import collections
 import itertools 
 import copy
+from .binning import Binning
 
-__all__ = ["PdfBase"]
+__all__ = ["PdfBase", "PdfView"]
 
 
 
@@ -13,22 +14,56 @@ class PdfBase(abc.ABC):
     """PDF base class"""
     #Thi
     
-    def __init__(self, frequencies = None, errors2 = None, **kwargs):
+    #Frequencies depend on the value of a parameter (see MorphingPdf)
+    dynamic = False
+    
+    #No binning: pdfs pickled before binnings existed do not have the attribute
+    _binning = None
+    
+    def __init__(self, frequencies = None, errors2 = None, binning = None, **kwargs):
+        
+        self._binning = binning
         
         if frequencies is not None:
             frequencies = np.asarray(frequencies)
-            self.frequencies = frequencies
+            #N-D histograms are kept flattened, the binning keeps the shape
+            if self._binning is None:
+                self._binning = Binning.from_shape(frequencies.shape)
+            self.frequencies = np.ravel(frequencies)
            
         if errors2 is not None:
             errors2 = np.asarray(errors2)
-            self.errors2 = errors2
+            self.errors2 = np.ravel(errors2)
         
        
         self._meta_data = kwargs.copy()
+    
+    @classmethod
+    def from_histogram(cls, counts, edges = None, errors2 = None, names = None, **kwargs):
+        """ Pdf from a (weighted) N-D histogram, e.g. the output of np.histogramdd.
+        Counts are normalized to 1 and errors2 by the square of the same normalization."""
+        counts = np.asarray(counts, dtype=float)
+        norm = np.sum(counts)
+        if edges is None:
+            binning = Binning.from_shape(counts.shape, names=names)
+        else:
+            binning = Binning(edges, names=names)
+        if errors2 is not None:
+            errors2 = np.asarray(errors2, dtype=float) / norm**2
+        return cls(counts / norm, errors2=errors2, binning=binning, **kwargs)
      
             
     def __getitem__(self, index: int):
         return self.frequencies[index]
+    
+    def evaluate_batch(self, columns: dict, index = slice(None)) -> np.ndarray:
+        """ Frequencies for a batch of parameter values (name -> column (n_points, 1)),
+        pdfs that do not depend on parameters just return their frequencies """
+        return self[index]
+    
+    def errors2_batch(self, columns: dict, index = slice(None)) -> np.ndarray:
+        """errors2 for a batch of parameter values, see evaluate_batch"""
+        return self.errors2[index]
         
     @property
     def meta_data(self) -> dict:
@@ -61,10 +96,46 @@ class PdfBase(abc.ABC):
             raise ValueError("Cannot have negative values in the pdf.")
         elif not np.isclose(np.sum(frequencies),1.):
             raise ValueError("PDF is not normalized!")
+        elif self._binning is not None and np.size(frequencies) != self._binning.nbins:
+            raise ValueError("Number of frequencies {} does not match the binning {}".format(np.size(frequencies), self._binning.shape))
             
         self._frequencies = frequencies
         
         
+    def set_frequencies(self, frequencies: np.ndarray, check = True) -> None:
+        """ Sets the frequencies, check=False skips the checks of the setter (sign, normalization,
+        number of bins) for rows of a block that is already normalized in bulk (see bootstrap) """
+        if check:
+            self.frequencies = frequencies
+        else:
+            self._frequencies = frequencies
+    
+    def bootstrap(self, n_boot, seed = None) -> np.ndarray:
+        """ Fluctuated versions of the template for its MC statistical uncertainty, as one block
+        (n_boot, nbins) with every row normalized to 1.
+
+        Each bin is resampled as a weighted Poisson count: it holds frequency^2 / errors2 effective
+        events of weight errors2 / frequency, so the fluctuated bin has the frequency as mean and
+        errors2 as variance. Bins without errors2 are kept. seed is a seed or a np.random.Generator.
+        """
+        if self.dynamic:
+            raise ValueError("Bootstrap of {} is not implemented".format(type(self).__name__))
+        frequencies = np.asarray(self.frequencies, dtype=float)
+        errors2 = np.asarray(self.errors2, dtype=float)
+        rng = np.random.default_rng(seed)
+        
+        fluctuate = np.flatnonzero((errors2 > 0) & (frequencies > 0))
+        weights = errors2[fluctuate] / frequencies[fluctuate]
+        block = np.tile(frequencies, (n_boot, 1))
+        block[:, fluctuate] = rng.poisson(frequencies[fluctuate] / weights, size=(n_boot, len(fluctuate))) * weights
+        
+        norm = np.sum(block, axis=1, keepdims=True)
+        #A replica with every bin fluctuated to zero is replaced by the template
+        empty = norm[:, 0] <= 0
+        block[empty], norm[empty] = frequencies, 1.
+        block /= norm
+        return block
+        
     @property
     def errors2(self):
         try:
@@ -84,11 +155,47 @@ class PdfBase(abc.ABC):
         """Number of bins of the pdf"""
         return len(self._frequencies)
     
+    @property
+    def binning(self) -> Optional[Binning]:
+        return self._binning
+    
+    def _require_binning(self) -> Binning:
+        if self._binning is None:
+            raise AttributeError("PDF {} has no binning, it has no N-D shape".format(self.name))
+        return self._binning
+    
+    @property
+    def shape(self) -> tuple:
+        """N-D shape of the histogram"""
+        return self._require_binning().shape
+    
+    @property
+    def edges(self) -> list:
+        """Bin edges of each axis"""
+        return self._require_binning().edges
+    
+    def reshape(self, values = None) -> np.ndarray:
+        """Frequencies (or any per-bin values) in the N-D shape of the histogram"""
+        if values is None:
+            values = self.frequencies
+        return self._require_binning().reshape(values)
+    
     
     def copy(self):
         """A deep copy"""
         return copy.deepcopy(self)
-    
+
+    def __deepcopy__(self, memo):
+        #Read-only arrays (e.g. templates attached from an ArrayStore) cannot change, copies share them
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+        for key, value in self.__dict__.items():
+            if isinstance(value, np.ndarray) and not value.flags.writeable:
+                new.__dict__[key] = value
+            else:
+                new.__dict__[key] = copy.deepcopy(value, memo)
+        return new
+
     def __mul__(self, other):
         """If we multiply by a float or a int, the method returns simply the frequencies multiplied """
         if isinstance(other, int) or isinstance(other, float):
@@ -126,6 +233,91 @@ class PdfBase(abc.ABC):
     def __radd__(self, other):
         return self.__add__(other)
 
+
+class PdfView(PdfBase):
+    """ Pdf restricted to a subset of the bins of another pdf and renormalized to 1 on them.
+    The frequencies of the parent are not copied, bins are gathered when the view is evaluated."""
+    
+    def __init__(self, pdf, index):
+        self._parent = pdf
+        self._index = np.asarray(index)
+        self._norm = np.sum(pdf[self._index])
+        if not self._norm > 0:
+            raise ValueError("PDF {} is empty in the selected bins".format(pdf.name))
+        self._binning = None
+        self._meta_data = pdf.meta_data
+        
+    def __getitem__(self, index):
+        if self._parent.dynamic:
+            #Normalization in the region changes with the parameters of the parent
+            return self._parent[self._index[index]] / np.sum(self._parent[self._index])
+        return self._parent[self._index[index]] / self._norm
+    
+    def evaluate_batch(self, columns, index = slice(None)):
+        values = self._parent.evaluate_batch(columns, self._index[index])
+        if self._parent.dynamic:
+            return values / np.sum(self._parent.evaluate_batch(columns, self._index), axis=-1, keepdims=True)
+        return values / self._norm
+    
+    def derivative_batch(self, columns, name, index = slice(None)):
+        """Derivative of the renormalized frequencies with respect to a parameter of a dynamic parent"""
+        values = self._parent.evaluate_batch(columns, self._index[index])
+        derivative = self._parent.derivative_batch(columns, name, self._index[index])
+        norm = np.sum(self._parent.evaluate_batch(columns, self._index), axis=-1, keepdims=True)
+        dnorm = np.sum(self._parent.derivative_batch(columns, name, self._index), axis=-1, keepdims=True)
+        return derivative / norm - values * dnorm / norm**2
+    
+    def second_derivative_batch(self, columns, name, other, index = slice(None)):
+        """Second derivative of the renormalized frequencies with respect to two parameters of a dynamic parent"""
+        parent, select = self._parent, self._index[index]
+        p = parent.evaluate_batch(columns, select)
+        pa, pb = parent.derivative_batch(columns, name, select), parent.derivative_batch(columns, other, select)
+        pab = parent.second_derivative_batch(columns, name, other, select)
+        total = lambda values: np.sum(values, axis=-1, keepdims=True)
+        s = total(parent.evaluate_batch(columns, self._index))
+        sa, sb = total(parent.derivative_batch(columns, name, self._index)), total(parent.derivative_batch(columns, other, self._index))
+        sab = total(parent.second_derivative_batch(columns, name, other, self._index))
+        return pab / s - (pa * sb + pb * sa + p * sab) / s**2 + 2 * p * sa * sb / s**3
+    
+    def errors2_batch(self, columns, index = slice(None)):
+        errors2 = self._parent.errors2_batch(columns, self._index[index])
+        if self._parent.dynamic:
+            return errors2 / np.sum(self._parent.evaluate_batch(columns, self._index), axis=-1, keepdims=True)**2
+        return errors2 / self._norm**2
+    
+    @property
+    def dynamic(self) -> bool:
+        return self._parent.dynamic
+    
+    @property
+    def parameters(self) -> collections.OrderedDict:
+        return getattr(self._parent, "parameters", collections.OrderedDict())
+    
+    def bind(self, par):
+        self._parent.bind(par)
+    
+    @property
+    def parent(self) -> PdfBase:
+        return self._parent
+    
+    @property
+    def index(self) -> np.ndarray:
+        return self._index
     
+    @property
+    def frequencies(self):
+        return self[:]
+    
+    @property
+    def errors2(self):
+        return self._parent.errors2[self._index] / self._norm**2
+    
+    @property
+    def nbins(self) -> int:
+        return len(self._index)
+    
+    def reshape(self, values = None):
+        raise AttributeError("A view on a subset of bins has no N-D shape")
+        
 from .parameter import Parameter
 from .model import Model
@@ -0,0 +1,61 @@
+import abc
+from typing import Dict, List, Optional, Iterable, Mapping, Any, Tuple, Union
+import numpy as np
+import copy
+
+__all__ = ["Prior", "UniformPrior", "LogUniformPrior", "GaussianPrior"]
+
+
+class Prior(abc.ABC):
+    """ Prior base class
+
+    Priors are given in value space (not factor space) and are only shapes: the support
+    is always cut by the limits of the Parameter they are attached to, so they do not
+    need to be normalized.
+    """
+
+    @abc.abstractmethod
+    def logpdf(self, value: np.ndarray) -> np.ndarray:
+        """Log of the (unnormalized) prior density, vectorized"""
+
+    def copy(self):
+        """A deep copy"""
+        return copy.deepcopy(self)
+
+
+class UniformPrior(Prior):
+    """Flat prior, inside the limits of the parameter"""
+
+    def logpdf(self, value):
+        return np.zeros(np.shape(value))
+
+    def __str__(self):
+        return "Uniform"
+
+
+class LogUniformPrior(Prior):
+    """Flat in log(value), needs positive limits"""
+
+    def logpdf(self, value):
+        value = np.asarray(value, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(value > 0, -np.log(value), -np.inf)
+
+    def __str__(self):
+        return "LogUniform"
+
+
+class GaussianPrior(Prior):
+    """Gaussian constraint, e.g. on a nuisance parameter with an external measurement"""
+
+    def __init__(self, mu, sigma):
+        if sigma <= 0:
+            raise ValueError("Sigma of a gaussian prior needs to be positive")
+        self.mu = mu
+        self.sigma = sigma
+
+    def logpdf(self, value):
+        return -0.5 * ((np.asarray(value, dtype=float) - self.mu) / self.sigma)**2
+
+    def __str__(self):
+        return "Gaussian({}, {})".format(self.mu, self.sigma)
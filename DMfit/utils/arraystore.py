@@ -0,0 +1,110 @@
+import os
+import hashlib
+import collections
+import numpy as np
+from multiprocessing import shared_memory
+
+__all__ = ["ArrayStore", "ArrayHandle", "attach"]
+
+
+#Picklable reference to an array of a store: kind is "shm" (location is the name of the shared
+#memory block) or "npy" (location is the path of a .npy file)
+ArrayHandle = collections.namedtuple("ArrayHandle", ["kind", "location", "shape", "dtype"])
+
+#Arrays attached in this process, location -> (shared memory block or None, array)
+_attached = {}
+
+
+def attach(handle: ArrayHandle) -> np.ndarray:
+    """ Read-only array of a handle, without copy. Arrays are attached once per process,
+    attaching the same handle again returns the same array. """
+    if handle.location in _attached:
+        return _attached[handle.location][1]
+    if handle.kind == "shm":
+        #Workers started by the owner share its resource tracker, the block is registered once
+        #and unlinked by the owner of the store
+        block = shared_memory.SharedMemory(name=handle.location)
+        array = np.ndarray(handle.shape, dtype=handle.dtype, buffer=block.buf)
+    elif handle.kind == "npy":
+        block = None
+        array = np.load(handle.location, mmap_mode="r")
+    else:
+        raise ValueError("Unknown kind of array handle {}".format(handle.kind))
+    array.flags.writeable = False
+    _attached[handle.location] = (block, array)
+    return array
+
+
+class ArrayStore():
+    """ Arrays shared with worker processes without copies
+
+    Arrays are put once in shared memory blocks (default) or in memory-mapped .npy files in
+    directory, and referred to by small picklable ArrayHandle; workers attach them zero-copy
+    with attach(handle). Identical arrays are stored once.
+
+    The store owns the arrays: shared memory is released by close (or at the end of a with
+    block), so the store needs to outlive the workers. .npy files are kept on disk unless
+    close(remove_files=True), so they can be attached by later jobs as well.
+    """
+
+    def __init__(self, directory = None):
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._handles = collections.OrderedDict()
+        self._blocks = []
+
+    def put(self, array) -> ArrayHandle:
+        array = np.ascontiguousarray(array)
+        h = hashlib.sha1(array.tobytes())
+        h.update("{}{}".format(array.shape, array.dtype.str).encode())
+        key = h.hexdigest()
+        if key in self._handles:
+            return self._handles[key]
+
+        if self.directory is None:
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[...] = array
+            shared.flags.writeable = False
+            self._blocks.append(block)
+            handle = ArrayHandle("shm", block.name, array.shape, array.dtype.str)
+            #Attaching in the owner process (e.g. without workers) returns the same array
+            _attached[handle.location] = (None, shared)
+        else:
+            path = os.path.join(self.directory, "{}.npy".format(key))
+            if not os.path.exists(path):
+                np.save(path, array)
+            handle = ArrayHandle("npy", os.path.abspath(path), array.shape, array.dtype.str)
+        self._handles[key] = handle
+        return handle
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(np.prod(h.shape) * np.dtype(h.dtype).itemsize for h in self._handles.values()))
+
+    def close(self, remove_files = False):
+        for block in self._blocks:
+            _attached.pop(block.name, None)
+            try:
+                block.close()
+            except BufferError:
+                #Arrays of the block are still in use in this process, the memory is freed with them
+                pass
+            block.unlink()
+        self._blocks = []
+        if remove_files:
+            for handle in self._handles.values():
+                if handle.kind == "npy" and os.path.exists(handle.location):
+                    os.remove(handle.location)
+        self._handles = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        kind = "shared memory" if self.directory is None else "memory-mapped files in {}".format(self.directory)
+        return "ArrayStore: {} arrays, {:.1f} MB in {}".format(len(self._handles), self.nbytes / 2**20, kind)
@@ -1,5 +1,9 @@
+import math
+import multiprocessing
+import concurrent.futures
 import numpy as np
-from numba import jit, njit
+import numba
+from numba import jit, njit, prange
 
 kwd = {"fastmath": True}
 
@@ -19,4 +23,183 @@ def nb_where(val):
 
 @njit(**kwd)
 def nb_random_poisson(val):
-    return np.random.poisson(val)
\ No newline at end of file
+    return np.random.poisson(val)
+
+@njit
+def nb_seed(seed):
+    #numba keeps its own random state, np.random.seed outside of a jitted function does not touch it
+    np.random.seed(seed)
+
+
+#The likelihood kernels release the GIL (nogil), so fits of different hypotheses can run at the same
+#time in threads. Calling parallel kernels from several threads needs a threadsafe threading layer
+#(tbb or omp), see concurrent_safe.
+
+#Reductions are done in blocks of fixed size, each block summed in order by one thread and
+#the partial sums added in order, so the result does not depend on the number of threads
+BLOCK = 4096
+
+def set_threads(nthreads):
+    """Number of threads of the parallel kernels (for the calling thread), None for all cores"""
+    numba.set_num_threads(numba.config.NUMBA_NUM_THREADS if nthreads is None else nthreads)
+
+@njit(inline="always", **kwd)
+def _poisson_term(k, mu):
+    #Bins with no expectation are skipped, as in the masked python version
+    if mu > 0:
+        return k * math.log(mu) - mu
+    return 0.
+
+#Above this alpha lgamma(k + alpha) - lgamma(alpha) is expanded, the Stirling series truncated
+#after 1 / x^5 is exact to double precision there
+STIRLING_ALPHA = 1e4
+
+@njit(inline="always", **kwd)
+def _stirling_tail(x):
+    #lgamma(x) - [(x - 0.5) log(x) - x + 0.5 log(2 pi)]
+    y = 1. / (x * x)
+    return (1. / 12. - y * (1. / 360. - y / 1260.)) / x
+
+@njit(inline="always", **kwd)
+def _lgamma_ratio_stirling(k, alpha):
+    #lgamma(k + alpha) - lgamma(alpha) with the large terms alpha * log(alpha) cancelled analytically
+    return (k * math.log(alpha) + (k + alpha - 0.5) * math.log1p(k / alpha) - k
+            + _stirling_tail(k + alpha) - _stirling_tail(alpha))
+
+@njit(inline="always", **kwd)
+def _effective_term(k, mu, var):
+    """ Effective likelihood (Arguelles, Schneider, Yuan, JHEP 2019), Poisson likelihood
+    marginalized over the MC uncertainty var of the expectation. The -lgamma(k + 1) term
+    is dropped as in the Poisson likelihood. """
+    if mu <= 0:
+        return 0.
+    if var <= 0:
+        return k * math.log(mu) - mu
+    alpha = mu * mu / var + 1.
+    beta = mu / var
+    #alpha * log(beta) - (k + alpha) * log(1 + beta), written to avoid the cancellation for small var
+    value = -alpha * math.log1p(1. / beta) - k * math.log1p(beta)
+    #lgamma(k + alpha) - lgamma(alpha): alpha can be huge (small MC error), where the difference of
+    #the two lgamma cancels. Small integer counts are summed exactly, large alpha uses Stirling
+    if k < 64 and k == math.floor(k):
+        for j in range(int(k)):
+            value += math.log(alpha + j)
+    elif alpha > STIRLING_ALPHA:
+        value += _lgamma_ratio_stirling(k, alpha)
+    else:
+        value += math.lgamma(k + alpha) - math.lgamma(alpha)
+    return value
+
+@njit(parallel=True, nogil=True, cache=True, **kwd)
+def nb_poisson_llh(values, expected):
+    """-log L of a Poisson likelihood, expected are the expected counts per bin"""
+    n = len(values)
+    nblocks = (n + BLOCK - 1) // BLOCK
+    partial = np.zeros(nblocks)
+    for b in prange(nblocks):
+        s = 0.
+        for i in range(b * BLOCK, min(n, (b + 1) * BLOCK)):
+            s += _poisson_term(values[i], expected[i])
+        partial[b] = s
+    total = 0.
+    for b in range(nblocks):
+        total += partial[b]
+    return -total
+
+@njit(parallel=True, nogil=True, cache=True, **kwd)
+def nb_effective_llh(values, expected, variance):
+    """-log L of the effective likelihood, variance is the MC variance of the expected counts"""
+    n = len(values)
+    nblocks = (n + BLOCK - 1) // BLOCK
+    partial = np.zeros(nblocks)
+    for b in prange(nblocks):
+        s = 0.
+        for i in range(b * BLOCK, min(n, (b + 1) * BLOCK)):
+            s += _effective_term(values[i], expected[i], variance[i])
+        partial[b] = s
+    total = 0.
+    for b in range(nblocks):
+        total += partial[b]
+    return -total
+
+@njit(parallel=True, nogil=True, cache=True, **kwd)
+def nb_poisson_llh_rows(values, expected):
+    """nb_poisson_llh of each row of expected (n_points, nbins), rows run in parallel"""
+    npoints, n = expected.shape
+    out = np.zeros(npoints)
+    for p in prange(npoints):
+        total = 0.
+        for b in range(0, n, BLOCK):
+            s = 0.
+            for i in range(b, min(n, b + BLOCK)):
+                s += _poisson_term(values[i], expected[p, i])
+            total += s
+        out[p] = -total
+    return out
+
+@njit(parallel=True, nogil=True, cache=True, **kwd)
+def nb_effective_llh_rows(values, expected, variance):
+    """nb_effective_llh of each row of expected and variance (n_points, nbins), rows run in parallel"""
+    npoints, n = expected.shape
+    out = np.zeros(npoints)
+    for p in prange(npoints):
+        total = 0.
+        for b in range(0, n, BLOCK):
+            s = 0.
+            for i in range(b, min(n, b + BLOCK)):
+                s += _effective_term(values[i], expected[p, i], variance[p, i])
+            total += s
+        out[p] = -total
+    return out
+
+@njit(parallel=True, nogil=True, cache=True, **kwd)
+def nb_interpolated_log_density(density, strides, index, fraction):
+    """ Sum over events of the log of a density multilinearly interpolated between bin centers.
+    density is flat (C order) with strides (in bins) per axis, index and fraction (nevents, ndim)
+    are the cached interpolation lookups of the events (Binning.interpolation_lookup).
+    Events with no density are skipped, as bins with no expectation in nb_poisson_llh."""
+    n, ndim = index.shape
+    nblocks = (n + BLOCK - 1) // BLOCK
+    partial = np.zeros(nblocks)
+    for b in prange(nblocks):
+        s = 0.
+        for e in range(b * BLOCK, min(n, (b + 1) * BLOCK)):
+            value = 0.
+            for corner in range(1 << ndim):
+                weight = 1.
+                flat = 0
+                for a in range(ndim):
+                    if (corner >> a) & 1:
+                        weight *= fraction[e, a]
+                        flat += (index[e, a] + 1) * strides[a]
+                    else:
+                        weight *= 1. - fraction[e, a]
+                        flat += index[e, a] * strides[a]
+                if weight > 0:
+                    value += weight * density[flat]
+            if value > 0:
+                s += math.log(value)
+        partial[b] = s
+    total = 0.
+    for b in range(nblocks):
+        total += partial[b]
+    return total
+
+def concurrent_safe():
+    """ True if the parallel kernels can be called from several threads at the same time: the
+    tbb and omp threading layers are threadsafe, the workqueue layer is not """
+    try:
+        layer = numba.threading_layer()
+    except ValueError:
+        #The layer is only chosen at the first call of a parallel kernel
+        nb_poisson_llh(np.zeros(1), np.ones(1))
+        layer = numba.threading_layer()
+    return layer != "workqueue"
+
+def process_pool(nprocesses):
+    """ Process pool that is safe with the parallel kernels: forking a process in which the
+    numba threading layer (OpenMP/TBB) is already running can abort or hang the workers,
+    so workers are started from a fresh forkserver (spawn where there is no forkserver).
+    As with spawn, scripts using the pool need an if __name__ == "__main__" guard. """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return concurrent.futures.ProcessPoolExecutor(max_workers=nprocesses, mp_context=multiprocessing.get_context(method))
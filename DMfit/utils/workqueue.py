@@ -0,0 +1,246 @@
+"""
+Filesystem backed work queue
+
+A job is split in work units stored in a shared directory. Workers on any host
+that can see the directory claim units, run them and write the results back:
+
+    <directory>/jobs/<job>.pkl      arguments shared by every unit of a job, written once
+    <directory>/pending/<id>.pkl    units waiting for a worker
+    <directory>/running/<id>.pkl    claimed units, the mtime is the heartbeat of the worker
+    <directory>/done/<id>.pkl       finished units
+    <directory>/failed/<id>.pkl     units that raised, traceback in <id>.err
+    <directory>/results/<id>.pkl    output of each unit
+
+Claiming is an os.rename from pending/ to running/, which is atomic: only one
+worker can win a unit. A unit whose heartbeat is older than the timeout is moved
+back to pending/ by any worker. Results are written to a temporary file and then
+renamed, so a unit that ran twice after a requeue just overwrites its result.
+Unit ids are <job>-<number>, so several jobs can share a queue and be merged
+separately.
+
+A worker can be started from the command line (from the DMfit directory):
+
+    python -m utils.workqueue <directory>
+"""
+import os
+import socket
+import time
+import pickle
+import threading
+import traceback
+import argparse
+import uuid
+import numpy as np
+
+__all__ = ["WorkQueue"]
+
+STATES = ["pending", "running", "done", "failed", "results"]
+JOBS = "jobs"
+
+
+class WorkQueue():
+
+    def __init__(self, directory, timeout = 600., heartbeat = 30.):
+        """
+        - directory: shared directory of the queue, it is created if it does not exist
+        - timeout: seconds without heartbeat after which a running unit is requeued
+        - heartbeat: seconds between heartbeats of a worker
+        """
+        self.directory = directory
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        #Pickled shared arguments of the jobs already read by this worker
+        self._jobs = {}
+        for state in STATES + [JOBS]:
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+    def _path(self, state, unit_id, ext = ".pkl"):
+        return os.path.join(self.directory, state, unit_id + ext)
+
+    def _ids(self, state, job = None):
+        ids = sorted(f[:-4] for f in os.listdir(os.path.join(self.directory, state)) if f.endswith(".pkl"))
+        if job is None:
+            return ids
+        return [unit_id for unit_id in ids if unit_id.rsplit("-", 1)[0] == job]
+
+    def jobs(self) -> list:
+        """Ids of the jobs submitted to the queue"""
+        return self._ids(JOBS)
+
+    @staticmethod
+    def _write(path, obj):
+        """Atomic write, readers never see a partial file"""
+        tmp = "{}.{}.{}.tmp".format(path, socket.gethostname(), os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(obj, f)
+        os.replace(tmp, path)
+
+    def submit(self, function, arguments, shared = None, job = None) -> str:
+        """ Adds a job with one unit per element of arguments, each unit calls function(**shared, **kwargs).
+        function has to be importable by the workers (defined at module level).
+
+        - shared: keyword arguments common to every unit (e.g. the LikelihoodRatioTest with its
+          templates), written once for the job instead of once per unit
+        - job: id of the job, by default a new unique id
+        Returns the id of the job.
+        """
+        if job is None:
+            job = uuid.uuid4().hex[:12]
+        if "-" in job:
+            raise ValueError("Job id {} cannot contain '-'".format(job))
+        if os.path.exists(self._path(JOBS, job)):
+            raise ValueError("Job {} is already in the queue".format(job))
+        self._write(self._path(JOBS, job), {} if shared is None else shared)
+        for i, kwargs in enumerate(arguments):
+            unit_id = "{}-{:08d}".format(job, i)
+            self._write(self._path("pending", unit_id), {"function" : function, "kwargs" : kwargs, "job" : job})
+        return job
+
+    def status(self, job = None) -> dict:
+        return {state : len(self._ids(state, job)) for state in STATES}
+
+    def _shared(self, job) -> dict:
+        """ Shared arguments of a job. The file is read once per worker but every unit gets its own
+        copy, units modify their arguments (e.g. the fits warm start the test) and must not see each other """
+        if job not in self._jobs:
+            with open(self._path(JOBS, job), "rb") as f:
+                self._jobs[job] = f.read()
+        return pickle.loads(self._jobs[job])
+
+    def requeue_stale(self) -> list:
+        """ Moves running units without a recent heartbeat back to pending """
+        requeued = []
+        now = time.time()
+        for unit_id in self._ids("running"):
+            path = self._path("running", unit_id)
+            try:
+                if now - os.path.getmtime(path) > self.timeout:
+                    os.rename(path, self._path("pending", unit_id))
+                    requeued.append(unit_id)
+            except FileNotFoundError:
+                #Finished or requeued by someone else in the meantime
+                pass
+        return requeued
+
+    def claim(self):
+        """ Claims a pending unit, returns its id or None if there is nothing to claim """
+        for unit_id in self._ids("pending"):
+            try:
+                #Rename keeps the mtime of the pending file: the heartbeat starts before the rename,
+                #otherwise requeue_stale could move the unit back before its first beat
+                os.utime(self._path("pending", unit_id))
+                os.rename(self._path("pending", unit_id), self._path("running", unit_id))
+            except FileNotFoundError:
+                #Another worker was faster
+                continue
+            return unit_id
+        return None
+
+    def _beat(self, unit_id, stop):
+        path = self._path("running", unit_id)
+        while not stop.wait(self.heartbeat):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return
+
+    def run_unit(self, unit_id):
+        """ Runs a claimed unit and stores its result """
+        stop = threading.Event()
+        beat = threading.Thread(target=self._beat, args=(unit_id, stop), daemon=True)
+        beat.start()
+        try:
+            with open(self._path("running", unit_id), "rb") as f:
+                unit = pickle.load(f)
+            result = unit["function"](**self._shared(unit["job"]), **unit["kwargs"])
+        except Exception:
+            stop.set()
+            with open(self._path("failed", unit_id, ".err"), "w") as f:
+                f.write("{}:{}\n".format(socket.gethostname(), os.getpid()))
+                f.write(traceback.format_exc())
+            self._finish(unit_id, "failed")
+            return False
+        stop.set()
+        self._write(self._path("results", unit_id), result)
+        self._finish(unit_id, "done")
+        return True
+
+    def _finish(self, unit_id, state):
+        try:
+            os.rename(self._path("running", unit_id), self._path(state, unit_id))
+        except FileNotFoundError:
+            #The unit was requeued while running, it will run again but the result is already there
+            pass
+
+    def work(self, max_units = None, wait = True, poll = 1.):
+        """ Worker loop: claims and runs units until the queue is empty
+
+        - max_units: stop after this number of units
+        - wait: keep polling while other workers have running units, as they may be requeued
+        Returns the number of units run by this worker.
+        """
+        nrun = 0
+        while max_units is None or nrun < max_units:
+            unit_id = self.claim()
+            if unit_id is None:
+                if self.requeue_stale():
+                    continue
+                if not wait or len(self._ids("running")) == 0:
+                    break
+                time.sleep(poll)
+                continue
+            self.run_unit(unit_id)
+            nrun += 1
+        return nrun
+
+    def results(self, job = None, allow_partial = False) -> list:
+        """ Results of the finished units of a job, ordered by unit id (see merge for job).
+        Raises if some units are not done, unless allow_partial """
+        job = self._job(job)
+        if not allow_partial:
+            status = self.status(job)
+            if status["pending"] + status["running"] + status["failed"] > 0:
+                raise ValueError("Job {} is not complete ({} pending, {} running, {} failed), use allow_partial to get the finished units"
+                                 .format(job, status["pending"], status["running"], status["failed"]))
+        results = []
+        for unit_id in self._ids("results", job):
+            with open(self._path("results", unit_id), "rb") as f:
+                results.append(pickle.load(f))
+        return results
+
+    def _job(self, job):
+        if job is not None:
+            return job
+        jobs = self.jobs()
+        if len(jobs) != 1:
+            raise ValueError("There are {} jobs in the queue, choose one of {}".format(len(jobs), jobs))
+        return jobs[0]
+
+    def merge(self, job = None, allow_partial = False):
+        """ Merges the results of all units of a job (it can be omitted if the queue has a single job).
+        Dictionaries of arrays are concatenated key by key, anything else is returned as a list
+        ordered by unit id. Raises if the job is not complete, unless allow_partial. """
+        results = self.results(job, allow_partial)
+        if len(results) > 0 and all(isinstance(r, dict) for r in results):
+            return {key : np.concatenate([np.atleast_1d(r[key]) for r in results]) for key in results[0].keys()}
+        return results
+
+    def __str__(self):
+        lines = []
+        lines.append("WorkQueue in {}".format(self.directory))
+        for state, n in self.status().items():
+            lines.append(" {}: {}".format(state, n))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a worker on a DMfit work queue")
+    parser.add_argument("directory")
+    parser.add_argument("--timeout", type=float, default=600.)
+    parser.add_argument("--heartbeat", type=float, default=30.)
+    parser.add_argument("--max-units", type=int, default=None)
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.directory, timeout=args.timeout, heartbeat=args.heartbeat)
+    nrun = queue.work(max_units=args.max_units)
+    print("Worker {}:{} ran {} units".format(socket.gethostname(), os.getpid(), nrun))
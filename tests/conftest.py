@@ -0,0 +1,38 @@
+import os
+import sys
+import contextlib
+import io
+import numpy as np
+import pytest
+
+#Modules of the package are imported as top level modules (from modeling import ...), as in the examples
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DMfit"))
+
+from modeling import PdfBase, Parameter
+from data import DataSet
+from llh import LikelihoodRatioTest
+
+
+def _normalized(values):
+    values = np.ravel(values)
+    return values / np.sum(values)
+
+
+@pytest.fixture
+def toy():
+    """ Signal on top of two backgrounds on a 20 x 15 histogram, H0 without signal,
+    data sampled from H1 with 20000 events """
+    x = np.linspace(0, 1, 20)[:, None]
+    y = np.linspace(0, 1, 15)[None, :]
+    signal = PdfBase(_normalized(np.exp(-((x - .3)**2 + (y - .2)**2) / 0.01) + 1e-6), name="SignalPDF")
+    atmos = PdfBase(_normalized(np.exp(-2 * x) * np.ones_like(y)), name="AtmosPDF")
+    astro = PdfBase(_normalized(np.exp(-3 * y) * np.ones_like(x)), name="AstroPDF")
+    f_sig = Parameter(value=0.02, limits=(0, 1), name="f_sig")
+    f_atmos = Parameter(value=0.6, limits=(0, 1), is_nuisance=True, name="f_atmos")
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = f_sig * signal + (1 - f_sig) * (f_atmos * atmos + (1 - f_atmos) * astro)
+        null_model = f_atmos * atmos + (1 - f_atmos) * astro
+
+    np.random.seed(1)
+    data = DataSet(values=np.random.poisson(20000 * model[:]))
+    return LikelihoodRatioTest(model=model, null_model=null_model, data=data)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("llh_type", ["Poisson", "Effective"])
+@pytest.mark.parametrize("hypothesis", ["H0", "H1"])
+def test_llh_batch_matches_the_single_evaluation(toy, llh_type, hypothesis):
+    for model in toy.models.values():
+        for pdf in model.pdfs.values():
+            pdf.errors2 = (0.05 * pdf[:])**2
+    toy.llh_type = llh_type
+    parameters = toy.models[hypothesis].parameters
+    nominal = [par.factor for par in parameters.values()]
+
+    rng = np.random.default_rng(2)
+    pars = np.array(nominal) * rng.uniform(0.5, 1.5, (7, len(nominal)))
+    #Small blocks, so the rows are split in several chunks
+    batch = toy.llh_batch(hypothesis, pars, batch_memory=2 * 4 * 8 * 300)
+    single = getattr(toy, "llh" + hypothesis)
+    np.testing.assert_allclose(batch, [single(row) for row in pars], rtol=1e-12)
+
+    #The single evaluation sets the parameters, the batch must not
+    for par, factor in zip(parameters.values(), nominal):
+        par.factor = factor
+    toy.llh_batch(hypothesis, pars)
+    assert [par.factor for par in parameters.values()] == nominal
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from llh import ConfidenceBelt
+
+
+def test_interval_on_the_physical_limit():
+    #The minimizer stops close to, not at, the limit: the first acceptance bounds are tiny but not 0
+    grid = np.linspace(0, 0.02, 11)
+    accept_low = np.array([5e-13, 5e-13, 4e-13, 0.001, 0.002, 0.004, 0.006, 0.008, 0.010, 0.012, 0.014])
+    accept_high = grid + 0.005
+    belt = ConfidenceBelt("f_sig", grid, np.zeros(11), accept_low, accept_high, limits=(0., 1.))
+
+    #The limit is the first true value whose acceptance region does not contain the best fit
+    lower, upper = belt.interval(0.)
+    assert lower == 0.
+    assert upper == pytest.approx(grid[3])
+    assert belt.interval(1e-9)[1] == pytest.approx(upper)
+    #Inside the belt the upper end is interpolated on the increasing part of the bound
+    assert belt.interval(0.003)[1] == pytest.approx(0.009)
+
+
+def test_interval_on_a_coarse_grid_is_not_empty():
+    grid = np.array([0., 0.02, 0.04])
+    belt = ConfidenceBelt("f_sig", grid, np.zeros(3), np.array([0., 0.01, 0.03]), grid + 0.01, limits=(0., 1.))
+    lower, upper = belt.interval(0.)
+    assert lower == 0. and upper == pytest.approx(0.02)
+    #A best fit between the acceptance regions of two grid points still gives an interval
+    lower, upper = belt.interval(0.035)
+    assert upper > lower
+
+
+@pytest.mark.parametrize("ordering", ["feldman-cousins", "neyman-upper"])
+def test_best_fit_of_zero_gives_a_limit(toy, ordering, tmp_path):
+    toy.models["H1"].parameters["f_sig"].value = 0.
+    belt = ConfidenceBelt.build(toy, "f_sig", np.linspace(0, 0.02, 6), ntotal=2000, ntrials=40, ordering=ordering,
+                                nprocesses=1, seed=1, cache_dir=str(tmp_path))
+    assert belt.upperlimit(0.) > 0.
+
+    cached = ConfidenceBelt.build(toy, "f_sig", np.linspace(0, 0.02, 6), ntotal=2000, ntrials=40, ordering=ordering,
+                                  nprocesses=1, seed=1, cache_dir=str(tmp_path))
+    assert cached.upperlimit(0.) == belt.upperlimit(0.)
+    assert cached.meta_data["ntrials"] == 40 and cached.meta_data["seed"] == 1
+
+
+def test_belt_does_not_depend_on_the_number_of_processes(toy):
+    kwargs = dict(ntotal=2000, ntrials=30, chunksize=10, seed=1)
+    one = ConfidenceBelt.build(toy, "f_sig", np.linspace(0, 0.02, 3), nprocesses=1, **kwargs)
+    two = ConfidenceBelt.build(toy, "f_sig", np.linspace(0, 0.02, 3), nprocesses=2, **kwargs)
+    np.testing.assert_allclose(one.accept_high, two.accept_high)
+    np.testing.assert_allclose(one.accept_low, two.accept_low)
+
+
+def test_cache_key_depends_on_the_likelihood(toy):
+    model = toy.models["H1"]
+    key = ConfidenceBelt.cache_key(model, "f_sig", [0, 0.01], 1000, 10, 90, "feldman-cousins", 1, likelihood=toy.settings())
+    toy.llh_type = "Effective"
+    other = ConfidenceBelt.cache_key(model, "f_sig", [0, 0.01], 1000, 10, 90, "feldman-cousins", 1, likelihood=toy.settings())
+    assert key != other
@@ -0,0 +1,24 @@
+import numpy as np
+
+from llh.bootstrap import template_bootstrap
+
+
+def _with_errors(toy):
+    for model in toy.models.values():
+        for pdf in model.pdfs.values():
+            pdf.errors2 = (0.05 * pdf[:])**2
+    return toy
+
+
+def test_bootstrap_is_reproducible(toy):
+    toy = _with_errors(toy)
+    one = template_bootstrap(toy, 6, nprocesses=1, seed=3)
+    again = template_bootstrap(toy, 6, nprocesses=1, seed=3, chunksize=4)
+    two = template_bootstrap(toy, 6, nprocesses=2, seed=3)
+    for key in ["fval", "f_sig", "f_atmos"]:
+        np.testing.assert_array_equal(again[key], one[key])
+        np.testing.assert_array_equal(two[key], one[key])
+    #Replicas differ from each other and from another seed
+    assert len(np.unique(one["f_sig"])) == 6
+    assert not np.array_equal(template_bootstrap(toy, 6, nprocesses=1, seed=4)["f_sig"], one["f_sig"])
+    assert np.all(one["valid"]) and np.all(np.isnan(one["upperlimit"]))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from llh import LikelihoodRatioTest
+from utils.numba_functions import concurrent_safe
+
+pytestmark = pytest.mark.skipif(not concurrent_safe(), reason="the numba threading layer cannot run kernels from several threads")
+
+
+def test_fit_concurrent_gives_the_sequential_fits(toy):
+    sequential = toy._clone()
+    sequential.fit("H0")
+    sequential.fit("H1")
+
+    concurrent = toy._clone()
+    results = concurrent.fit_concurrent(("H0", "H1"))
+    assert set(results.keys()) == {"H0", "H1"}
+    assert concurrent.TS == pytest.approx(sequential.TS, rel=1e-10)
+    for h in ["H0", "H1"]:
+        for name, par in concurrent.models[h].parameters.items():
+            assert par.value == pytest.approx(sequential.models[h].parameters[name].value, rel=1e-10)
+
+
+def test_concurrent_scan_gives_the_sequential_ts(toy):
+    #Profile likelihood scan: H0 is the signal model with f_sig fixed at the scanned value
+    model = toy.models["H1"]
+    toy = LikelihoodRatioTest(model=model, null_model=model, data=toy.data)
+    toy.models["H0"].parameters["f_sig"].fixed = True
+    values = [0.03, 0.04, 0.05, 0.06]
+    sequential = toy._clone()
+    expected = [sequential.TS_llhinterval(value, "f_sig", "f_sig") for value in values]
+
+    concurrent = toy._clone()
+    concurrent.concurrent = True
+    assert [concurrent.TS_llhinterval(value, "f_sig", "f_sig") for value in values] == pytest.approx(expected, rel=1e-10)
+
+    #Blocks of the scan are warm started from different points, the minima agree within the tolerance of the fits
+    before = [par.value for par in toy.models["H1"].parameters.values()]
+    np.testing.assert_allclose(toy.TS_scan(values, "f_sig", "f_sig", nworkers=2), expected, rtol=1e-3, atol=1e-3)
+    assert [par.value for par in toy.models["H1"].parameters.values()] == before
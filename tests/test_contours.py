@@ -0,0 +1,16 @@
+import pytest
+
+from llh.contours import profile_intervals
+
+
+@pytest.mark.parametrize("nprocesses", [1, 2])
+def test_profile_intervals_match_minos(toy, nprocesses):
+    intervals = profile_intervals(toy, nprocesses=nprocesses)
+
+    minuit = toy.fit("H1")
+    minuit.minos()
+    for name, (best, lower, upper) in intervals.items():
+        value = minuit.values[name]
+        assert best == pytest.approx(value, abs=1e-2 * minuit.errors[name])
+        assert lower == pytest.approx(value + minuit.merrors[name].lower, abs=1e-2 * minuit.errors[name])
+        assert upper == pytest.approx(value + minuit.merrors[name].upper, abs=1e-2 * minuit.errors[name])
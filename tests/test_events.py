@@ -0,0 +1,20 @@
+import numpy as np
+
+from modeling import Binning
+from data import DataSet
+
+
+def test_datasets_share_a_cache_dir(tmp_path):
+    binning = Binning([np.linspace(0, 1, 21), np.linspace(0, 1, 16)])
+    rng = np.random.default_rng(1)
+    first = DataSet.from_events(rng.random((5000, 2)), binning, chunksize=1000, cache_dir=str(tmp_path))
+    bins = np.array(first.event_bins)
+    index, fraction = [np.array(a) for a in first.event_interpolation]
+
+    second = DataSet.from_events(rng.random((3000, 2)), binning, chunksize=1000, cache_dir=str(tmp_path))
+    second.event_interpolation
+
+    assert np.array_equal(first.event_bins, bins)
+    assert np.array_equal(first.event_interpolation[0], index)
+    assert np.array_equal(first.event_interpolation[1], fraction)
+    assert np.array_equal(first.values, np.bincount(bins, minlength=binning.nbins))
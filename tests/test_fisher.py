@@ -0,0 +1,20 @@
+import numpy as np
+
+
+def test_covariance_matches_hesse(toy):
+    toy.fit("H1")
+    parameters = list(toy.models["H1"].parameters.values())
+    #The cross-check needs a best fit away from the limits, where Hesse is distorted
+    for par in parameters:
+        assert par.lower_limit + 0.01 < par.value < par.upper_limit - 0.01
+
+    minuit = toy.minimizers["H1"]
+    minuit.hesse()
+    scales = np.array([par.scale for par in parameters])
+    hesse = np.array(minuit.covariance) * np.outer(scales, scales)
+
+    analytic = toy.covariance("H1")
+    assert np.allclose(analytic, hesse, rtol=2e-3, atol=0)
+    assert np.allclose(np.sqrt(np.diag(analytic)), np.sqrt(np.diag(hesse)), rtol=1e-3, atol=0)
+    #The expected information drops the fluctuations of the data, it only agrees at the percent level
+    assert np.allclose(toy.covariance("H1", "expected"), hesse, rtol=5e-2, atol=0)
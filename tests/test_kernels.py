@@ -0,0 +1,72 @@
+import os
+import sys
+import math
+import subprocess
+import numpy as np
+import numba
+import pytest
+
+from utils.numba_functions import nb_poisson_llh, nb_effective_llh, nb_poisson_llh_rows, nb_effective_llh_rows, set_threads, BLOCK
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+PACKAGE = os.path.join(os.path.dirname(TESTS), "DMfit")
+
+
+def _inputs():
+    #More bins than a block, so the sum is split between threads
+    rng = np.random.default_rng(3)
+    expected = rng.uniform(0., 50., (3, 3 * BLOCK + 17))
+    expected[:, :10] = 0.
+    variance = expected**2 * rng.uniform(1e-8, 0.1, expected.shape)
+    values = rng.poisson(expected[0]).astype(float)
+    return values, expected, variance
+
+
+def llh_per_threads(threads = (1, 2, 4)):
+    values, expected, variance = _inputs()
+    out = []
+    for nthreads in threads:
+        set_threads(nthreads)
+        out.append([nb_poisson_llh(values, expected[0]), nb_effective_llh(values, expected[0], variance[0])]
+                   + list(nb_poisson_llh_rows(values, expected)) + list(nb_effective_llh_rows(values, expected, variance)))
+    set_threads(None)
+    return out
+
+
+def _effective_reference(k, mu, var):
+    #Definition of the effective likelihood, lgamma(k + alpha) / lgamma(alpha) written as a product for integer k
+    alpha, beta = mu * mu / var + 1., mu / var
+    return -alpha * math.log1p(1. / beta) - k * math.log1p(beta) + math.fsum(math.log(alpha + j) for j in range(int(k)))
+
+
+def test_kernels_do_not_depend_on_the_number_of_threads():
+    if numba.config.NUMBA_NUM_THREADS >= 4:
+        out = llh_per_threads()
+    else:
+        #The number of threads is capped by NUMBA_NUM_THREADS when numba is loaded
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE, TESTS]), NUMBA_NUM_THREADS="4")
+        code = "import test_kernels; print(repr(test_kernels.llh_per_threads()))"
+        out = eval(subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout)
+    for other in out[1:]:
+        assert other == out[0]
+
+
+def test_kernels_match_numpy():
+    values, expected, variance = _inputs()
+    mask = expected[0] > 0
+    poisson = -np.sum(values[mask] * np.log(expected[0][mask]) - expected[0][mask])
+    assert nb_poisson_llh(values, expected[0]) == pytest.approx(poisson, rel=1e-12)
+    np.testing.assert_allclose(nb_poisson_llh_rows(values, expected)[0], poisson, rtol=1e-12)
+
+    reference = -math.fsum(_effective_reference(k, mu, var) for k, mu, var in zip(values[mask], expected[0][mask], variance[0][mask]))
+    assert nb_effective_llh(values, expected[0], variance[0]) == pytest.approx(reference, rel=1e-12)
+    np.testing.assert_allclose(nb_effective_llh_rows(values, expected, variance)[0], reference, rtol=1e-12)
+
+
+@pytest.mark.parametrize("k", [0, 5, 64, 65, 1000, 5000])
+@pytest.mark.parametrize("relative_error", [0.3, 1e-2, 1e-4, 1e-6, 1e-7, 1e-9])
+def test_effective_term_for_small_variance(k, relative_error):
+    mu = max(k, 1.) * 1.1
+    var = (relative_error * mu)**2
+    value = -nb_effective_llh(np.array([float(k)]), np.array([mu]), np.array([var]))
+    assert value == pytest.approx(_effective_reference(k, mu, var), rel=1e-12, abs=1e-9)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from modeling import BinMerging
+from llh.asimov import asimov_sensitivity, merging_loss
+
+
+def test_build_apply_and_save(toy, tmp_path):
+    model = toy.models["H1"]
+    merging = BinMerging.build(model, 2000, "SignalPDF", min_background=5.)
+    assert merging.nbins == 300 and 0 < merging.ngroups < merging.nbins
+
+    #Merging sums counts, totals are conserved and the merged pdfs stay normalized
+    merged = toy.merge(merging)
+    assert np.sum(merged.data.values) == pytest.approx(np.sum(toy.data.values))
+    assert np.sum(merged.models["H1"][:]) == pytest.approx(1.)
+    np.testing.assert_allclose(merged.models["H1"][:], merging.apply(model[:]))
+    #The merged model shares the parameters of the original one
+    assert merging.model(model).parameters["f_sig"] is model.parameters["f_sig"]
+
+    merging.save(str(tmp_path / "merging.npz"))
+    loaded = BinMerging.load(str(tmp_path / "merging.npz"))
+    np.testing.assert_array_equal(loaded.group, merging.group)
+    assert loaded.meta_data == merging.meta_data
+
+
+def test_merging_keeps_the_sensitivity(toy):
+    merging = BinMerging.build(toy.models["H1"], 2000, "SignalPDF", min_background=5.)
+    report = merging_loss(toy, merging, "f_sig", 0.02, 2000, verbose=False)
+    assert report["merged"]["nbins"] == merging.ngroups
+    assert -1e-6 < report["ts_loss"] < 0.1
+
+
+def test_asimov_sensitivity_of_the_unbinned_likelihood(toy):
+    toy.llh_type = "Unbinned"
+    result = asimov_sensitivity(toy, "f_sig", 0.02, 2000)
+    assert result["ts"] > 0.
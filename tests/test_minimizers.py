@@ -0,0 +1,26 @@
+import numpy as np
+
+from llh.minimizers import lockstep_newton
+
+
+def test_failed_line_search_is_not_converged():
+    #The gradient points uphill, the line search cannot find a decrease
+    def evaluate(x, rows, derivatives):
+        f = np.sum((x - 1.)**2, axis=1)
+        if not derivatives:
+            return f
+        return f, -2 * (x - 1.), np.tile(2 * np.eye(x.shape[1]), (len(x), 1, 1))
+
+    f, x, converged, stalled, niter = lockstep_newton(evaluate, np.zeros((3, 2)), -5., 5., np.array([True, True]))
+    assert not np.any(converged)
+    assert np.all(stalled)
+
+
+def test_fit_batch_converges(toy):
+    samples = np.random.default_rng(1).poisson(20000 * toy.models["H0"][:], size=(50, len(toy.models["H0"])))
+    result = toy.fit_batch("H1", samples)
+    assert np.all(result["converged"]) and not np.any(result["stalled"])
+
+    toy.data.values = samples[0]
+    toy.fit("H1")
+    assert np.isclose(result["fval"][0], toy.minLlhH1, rtol=0, atol=1e-3)
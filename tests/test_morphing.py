@@ -0,0 +1,64 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+
+from modeling import PdfBase, MorphingPdf, Parameter
+from data import DataSet
+from llh import LikelihoodRatioTest
+
+
+def _morphing(value = 150.):
+    #Gaussian peaks moving with the mass, on a flat floor
+    x = np.linspace(0, 1, 40)
+    pdfs = []
+    for i, center in enumerate([0.2, 0.4, 0.6]):
+        values = np.exp(-(x - center)**2 / 0.005) + 1e-4
+        values /= np.sum(values)
+        pdfs.append(PdfBase(values, errors2=(1e-2 * values)**2, name="s{}".format(i)))
+    mass = Parameter(value=value, limits=(100, 400), name="mass")
+    return MorphingPdf.from_pdfs([100, 200, 400], pdfs, mass, name="signal"), pdfs
+
+
+def test_interpolation_and_derivatives():
+    morphing, pdfs = _morphing()
+    for m, pdf in zip([100., 200., 400.], pdfs):
+        np.testing.assert_allclose(morphing.evaluate(m), pdf.frequencies, atol=1e-15)
+    #Linear in log(mass): halfway in log between two references is their average
+    np.testing.assert_allclose(morphing.evaluate(np.sqrt(200. * 400.)), 0.5 * (pdfs[1].frequencies + pdfs[2].frequencies))
+    masses = np.array([120., 150., 250., 390.])
+    assert np.allclose(np.sum(morphing.evaluate(masses), axis=1), 1.)
+
+    step = 1e-4
+    columns = {"mass" : masses}
+    numeric = (morphing.evaluate(masses * (1 + step)) - morphing.evaluate(masses * (1 - step))) / (2 * step * masses[:, None])
+    np.testing.assert_allclose(morphing.derivative_batch(columns, "mass"), numeric, rtol=1e-6, atol=1e-12)
+    numeric = (morphing.derivative_batch({"mass" : masses * (1 + step)}, "mass")
+               - morphing.derivative_batch({"mass" : masses * (1 - step)}, "mass")) / (2 * step * masses[:, None])
+    np.testing.assert_allclose(morphing.second_derivative_batch(columns, "mass", "mass"), numeric, rtol=1e-6, atol=1e-12)
+
+
+@pytest.mark.parametrize("llh_type", ["Poisson", "Effective"])
+def test_fit_of_the_mass(llh_type):
+    morphing, pdfs = _morphing()
+    background = PdfBase(np.full(40, 1. / 40), name="background")
+    f_sig = Parameter(value=0.3, limits=(0, 1), name="f_sig")
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = f_sig * morphing + (1 - f_sig) * background
+        null_model = (1 - f_sig) * background
+    ds = DataSet()
+    ds.asimov(5000, model[:])
+    lr = LikelihoodRatioTest(model=model, null_model=null_model, data=ds, llh_type=llh_type)
+    assert list(lr.models["H1"].parameters.keys()) == ["f_sig", "mass"]
+
+    if lr.has_gradient:
+        #Analytic gradient through the morphing
+        pars = np.array([0.25, 230.])
+        step = np.array([1e-6, 1e-3])
+        numeric = [(lr.llhH1(pars + np.eye(2)[i] * step[i]) - lr.llhH1(pars - np.eye(2)[i] * step[i])) / (2 * step[i]) for i in range(2)]
+        np.testing.assert_allclose(lr.gradH1(pars), numeric, rtol=1e-5)
+
+    lr.models["H1"].parameters["mass"].value = 250.
+    lr.fit("H1")
+    assert lr.models["H1"].parameters["mass"].value == pytest.approx(150., rel=1e-3)
+    assert lr.models["H1"].parameters["f_sig"].value == pytest.approx(0.3, rel=1e-3)
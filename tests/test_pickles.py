@@ -0,0 +1,41 @@
+import pickle
+import numpy as np
+import pytest
+
+from modeling import PdfBase, MorphingPdf, Parameter, Model
+from data import DataSet
+
+
+def _old(obj, *names):
+    """Pickle round trip of obj without the attributes added after the first release, as in old pickles"""
+    for name in names:
+        del obj.__dict__[name]
+    return pickle.loads(pickle.dumps(obj))
+
+
+def test_pdfs_pickled_without_binning():
+    pdfs = []
+    for seed in (1, 2):
+        values = np.random.default_rng(seed).random(30)
+        pdfs.append(_old(PdfBase(values / np.sum(values), errors2=np.full(30, 1e-5), name="m{}".format(seed)), "_binning"))
+
+    assert pdfs[0].binning is None
+    pdfs[0].frequencies = pdfs[0].frequencies
+    assert Model(pdfs=pdfs[:1], expression="self._pdfs['m1'][index]").binning is None
+
+    mass = Parameter(value=150., limits=(100, 200), name="mass")
+    morphing = MorphingPdf.from_pdfs([100, 200], pdfs, mass, name="signal")
+    assert morphing.binning is None
+    assert np.isclose(np.sum(morphing[:]), 1.)
+
+
+def test_dataset_pickled_without_binning():
+    ds = _old(DataSet(values=np.arange(30)), "_binning", "_rois", "_events")
+    assert ds.binning is None and ds.rois == {}
+    ds.sample(100, np.full(30, 1. / 30))
+    assert len(ds.values) == 30
+    for attribute in ["shape", "edges"]:
+        with pytest.raises(AttributeError, match="no binning"):
+            getattr(ds, attribute)
+    with pytest.raises(AttributeError, match="no binning"):
+        ds.reshape()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from modeling import GaussianPrior
+from llh import EnsembleSampler
+
+
+def test_log_prob_includes_the_priors(toy):
+    f_atmos = toy.models["H1"].parameters["f_atmos"]
+    f_atmos.prior = GaussianPrior(0.5, 0.01)
+    sampler = EnsembleSampler(toy, nwalkers=8, seed=1)
+    assert sampler.names == ["f_sig", "f_atmos"]
+
+    points = np.array([[0.02, 0.6], [0.03, 0.55]])
+    expected = [-toy.llhH1(p) - 0.5 * ((p[1] - 0.5) / 0.01)**2 for p in points]
+    np.testing.assert_allclose(sampler.log_prob(points), expected, rtol=1e-12)
+    #Outside the limits of a parameter the posterior is 0
+    assert sampler.log_prob([[-0.01, 0.6]])[0] == -np.inf
+
+
+def test_posterior_with_and_without_prior(toy):
+    minuit = toy.fit("H1")
+    before = [par.value for par in toy.models["H1"].parameters.values()]
+
+    sampler = EnsembleSampler(toy, nwalkers=16, seed=2)
+    chain = sampler.run(1500)
+    assert chain.shape == (1500, 16, 2)
+    assert [par.value for par in toy.models["H1"].parameters.values()] == before
+    assert 0.2 < np.mean(sampler.acceptance_fraction) < 0.9
+    #Flat priors: the posterior is the gaussian likelihood around the best fit
+    samples = sampler.samples()
+    for i, name in enumerate(sampler.names):
+        assert np.mean(samples[:, i]) == pytest.approx(minuit.values[name], abs=0.2 * minuit.errors[name])
+        assert np.std(samples[:, i]) == pytest.approx(minuit.errors[name], rel=0.15)
+
+    #A narrow gaussian prior on the nuisance parameter dominates the likelihood
+    toy.models["H1"].parameters["f_atmos"].prior = GaussianPrior(0.58, 0.001)
+    sampler = EnsembleSampler(toy, nwalkers=16, seed=2)
+    sampler.run(1500)
+    f_atmos = sampler.samples()[:, 1]
+    sigma = minuit.errors["f_atmos"]
+    weight = sigma**-2 / (sigma**-2 + 0.001**-2)
+    assert np.mean(f_atmos) == pytest.approx(0.58 + weight * (minuit.values["f_atmos"] - 0.58), abs=3e-4)
+    assert np.std(f_atmos) < 0.0012
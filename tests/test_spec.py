@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+
+from llh.spec import LikelihoodSpec
+from utils.arraystore import ArrayStore
+from utils.numba_functions import process_pool
+
+
+def llh_of_spec(spec, pars):
+    lr = spec.build()
+    return lr.llhH0(pars[0]), lr.llhH1(pars[1])
+
+
+def _pars(lr):
+    return [np.array([par.factor for par in lr.models[h].parameters.values()]) * 1.1 for h in ["H0", "H1"]]
+
+
+@pytest.mark.parametrize("llh_type", ["Poisson", "Effective"])
+def test_rebuilt_likelihood_and_release(toy, llh_type, tmp_path):
+    for model in toy.models.values():
+        for pdf in model.pdfs.values():
+            pdf.errors2 = (0.05 * pdf[:])**2
+    toy.llh_type = llh_type
+    pars = _pars(toy)
+    expected = (toy.llhH0(pars[0]), toy.llhH1(pars[1]))
+
+    with ArrayStore() as store:
+        spec = LikelihoodSpec(toy, store)
+        names = [block.name for block in store._blocks]
+        assert len(names) > 0
+        assert llh_of_spec(spec, pars) == expected
+        with process_pool(1) as pool:
+            assert pool.submit(llh_of_spec, spec, pars).result() == expected
+    #The shared memory is released with the store
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    store = ArrayStore(str(tmp_path / "arrays"))
+    assert llh_of_spec(LikelihoodSpec(toy, store), pars) == expected
+    store.close(remove_files=True)
+    assert os.listdir(str(tmp_path / "arrays")) == []
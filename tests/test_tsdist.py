@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from llh import TSDistribution
+
+
+def test_pvalue_and_quantile():
+    rng = np.random.default_rng(5)
+    ts = rng.exponential(2., 1000)
+    dist = TSDistribution(np.append(ts, np.nan))
+    assert dist.ntrials == 1000
+
+    values = np.array([0., 0.5, 2., 7.5, 100.])
+    np.testing.assert_array_equal(dist.pvalue(values), [np.mean(ts >= v) for v in values])
+    assert dist.pvalue(ts[3]) == np.mean(ts >= ts[3])
+    for p in [0.5, 0.1, 0.01]:
+        q = dist.quantile(p)
+        assert dist.pvalue(q) >= p
+        assert dist.pvalue(np.nextafter(q, np.inf)) < p
+
+
+def test_tails():
+    rng = np.random.default_rng(6)
+    dist = TSDistribution(rng.exponential(2., 100000))
+    tail = dist.fit_tail("exponential", tail_fraction=0.05)
+    assert tail["scale"] == pytest.approx(2., rel=0.05)
+    #Extrapolation beyond the trials, and quantile is the inverse of pvalue
+    assert dist.pvalue(40.) == pytest.approx(np.exp(-20.), rel=0.3)
+    assert dist.quantile(dist.pvalue(40.)) == pytest.approx(40.)
+
+    #Half of the trials at 0 and half chi2 with one degree of freedom
+    ts = np.concatenate([np.zeros(50000), rng.chisquare(1., 50000)])
+    dist = TSDistribution(ts)
+    tail = dist.fit_tail("chi2", threshold=4.)
+    assert tail["eta"] == pytest.approx(0.5, rel=1e-3)
+    assert tail["ndof"] == pytest.approx(1., rel=0.05)
+    assert dist.pvalue(25.) == pytest.approx(0.5 * 5.733e-7, rel=0.3)
+
+
+def test_save_and_mmap_load(tmp_path):
+    dist = TSDistribution(np.random.default_rng(7).exponential(1., 500), name="background")
+    dist.fit_tail()
+    dist.save(str(tmp_path / "bkg"))
+
+    loaded = TSDistribution.load(str(tmp_path / "bkg"))
+    #A read only view of the file, not a copy
+    assert not loaded.ts.flags.writeable and not loaded.ts.flags.owndata
+    assert TSDistribution.load(str(tmp_path / "bkg"), mmap=False).ts.flags.writeable
+    assert loaded.name == "background" and loaded.tail == dist.tail
+    np.testing.assert_array_equal(loaded.ts, dist.ts)
+    np.testing.assert_array_equal(loaded.pvalue([0.1, 1., 10.]), dist.pvalue([0.1, 1., 10.]))
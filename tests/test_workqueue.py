@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+import numpy as np
+import pytest
+
+from utils.workqueue import WorkQueue
+from llh.trials import submit_trials, run_trials, _fresh
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+PACKAGE = os.path.join(os.path.dirname(TESTS), "DMfit")
+
+
+def slow_unit(marker, value):
+    #Hangs the first time it runs, so the worker can be killed in the middle of it
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        time.sleep(600)
+    return {"value" : np.array([value])}
+
+
+def _worker(directory, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE, TESTS]))
+    return subprocess.Popen([sys.executable, "-m", "utils.workqueue", directory, "--timeout", "3", "--heartbeat", "0.5"] + list(args),
+                            cwd=PACKAGE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _wait(condition, timeout = 120.):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout
+        time.sleep(0.1)
+
+
+def test_workers_requeue_and_merge(toy, tmp_path):
+    directory = str(tmp_path)
+    queue = WorkQueue(directory)
+
+    #A worker killed in the middle of a unit leaves it in running/, it is requeued after the timeout
+    marker = os.path.join(directory, "started")
+    slow = queue.submit(slow_unit, [{"marker" : marker, "value" : 1.}])
+    killed = _worker(directory, "--max-units", "1")
+    _wait(lambda: os.path.exists(marker))
+    killed.send_signal(signal.SIGKILL)
+    killed.wait()
+    assert queue.status(slow)["running"] == 1
+    with pytest.raises(ValueError):
+        queue.merge(slow)
+    assert queue.merge(slow, allow_partial=True) == []
+
+    #Second job in the same queue, the test is written once for the job and not in every unit
+    trials = submit_trials(queue, toy, ntotal=2000, ntrials=12, chunksize=3, seed=7)
+    unit = max(os.path.getsize(os.path.join(directory, "pending", f)) for f in os.listdir(os.path.join(directory, "pending")))
+    assert unit < os.path.getsize(os.path.join(directory, "jobs", trials + ".pkl")) / 10
+
+    workers = [_worker(directory) for _ in range(3)]
+    for worker in workers:
+        assert worker.wait(timeout=300) == 0
+
+    assert queue.status(trials) == {"pending" : 0, "running" : 0, "done" : 4, "failed" : 0, "results" : 4}
+    assert list(queue.merge(slow)["value"]) == [1.]
+    with pytest.raises(ValueError):
+        queue.merge()
+    merged = queue.merge(trials)
+    assert len(merged["ts"]) == 12
+
+    #Same trials as running the units in this process, whatever worker ran them
+    expected = [run_trials(_fresh(toy), 2000, 3, seed) for seed in np.random.SeedSequence(7).generate_state(4)]
+    assert np.allclose(merged["ts"], np.concatenate([r["ts"] for r in expected]))
+
+
+def test_claim_starts_the_heartbeat(tmp_path):
+    #A unit pending for longer than the timeout must not look stale once claimed
+    queue = WorkQueue(str(tmp_path), timeout=60.)
+    job = queue.submit(slow_unit, [{"marker" : "", "value" : 1.}])
+    pending = os.path.join(str(tmp_path), "pending", job + "-00000000.pkl")
+    os.utime(pending, (time.time() - 3600., time.time() - 3600.))
+    assert queue.claim() == job + "-00000000"
+    assert queue.requeue_stale() == []
+
+
+def test_trials_of_the_unbinned_likelihood(toy):
+    #Pseudo samples are histograms, the unbinned likelihood needs their binning for the bin volumes
+    toy.llh_type = "Unbinned"
+    result = run_trials(_fresh(toy), 2000, 2, 1)
+    assert np.all(np.isfinite(result["ts"]))